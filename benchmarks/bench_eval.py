@@ -0,0 +1,43 @@
+"""
+Compare walking dice trees with eval() to running compiled trees.
+
+Run from the repo root:  python -m benchmarks.bench_eval
+"""
+import argparse
+
+from dcabot.rolling import dice
+
+from .common import load_specs, time_per_call
+
+
+def nested(depth):
+    "A spec with depth levels of nested arithmetic, like ((d6 + 1) * (d4 - 2)) ^ ..."
+    spec = "d6"
+    ops = ["+ 1", "* d4", "- d8", "/ 2", "+ 2d6", "* (d4 - 1)"]
+    for i in range(depth):
+        spec = f"({spec} {ops[i % len(ops)]})"
+    return spec
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--min-time", type=float, default=1.0)
+    args = parser.parse_args()
+
+    cases = [("corpus", load_specs())] + [
+        (f"depth {depth}", [nested(depth)]) for depth in [4, 16, 64]
+    ]
+    for name, specs in cases:
+        trees = [dice.get_dice_tree(spec) for spec in specs]
+        t_eval = time_per_call(dice.get_result, trees, min_time=args.min_time)
+        t_comp = time_per_call(
+            lambda tree: dice.compile_tree(tree)(), trees, min_time=args.min_time
+        )
+        print(
+            f"{name:>10}:  eval {1 / t_eval:9.0f}/s   compiled {1 / t_comp:9.0f}/s"
+            f"   ({t_eval / t_comp:.2f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Time the check for inline [[rolls]] that every message goes through.
+
+Run from the repo root:  python -m benchmarks.bench_inline
+
+Uses the made-up chat in chat.txt, and the same with the rolls taken out, which is
+more like most channels most of the time.
+"""
+import argparse
+
+from dcabot.rolling import dice, inline
+
+from .common import HERE, time_per_call
+
+
+def load_chat(path=HERE / "chat.txt"):
+    with open(path) as f:
+        return [
+            line.rstrip("\n").replace("\\n", "\n")
+            for line in f
+            if line.strip() and not line.startswith("#")
+        ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--min-time", type=float, default=1.0)
+    args = parser.parse_args()
+
+    chat = load_chat()
+    plain = [m.replace("[[", "").replace("]]", "") for m in chat]
+    with_rolls = [m for m in chat if inline.find_specs(m)]
+    print(
+        f"{len(chat)} messages, {len(with_rolls)} with rolls "
+        f"({sum(len(inline.find_specs(m)) for m in chat)} rolls)"
+    )
+
+    def find_and_parse(message):
+        for spec in inline.find_specs(message):
+            try:
+                dice.get_dice_tree(spec)
+            except Exception:
+                pass
+
+    def parse_all(message):
+        try:
+            dice.parse(message)
+        except Exception:
+            pass
+
+    for name, fn, messages in [
+        ("substring check, no rolls", lambda m: inline.OPEN in m, plain),
+        ("pre-filter, no rolls", inline.find_specs, plain),
+        ("regex only, no rolls", inline.SPAN.findall, plain),
+        ("pre-filter, chat", inline.find_specs, chat),
+        ("pre-filter + parse, chat", find_and_parse, chat),
+        ("parsing everything", parse_all, chat),
+    ]:
+        t = time_per_call(fn, messages, min_time=args.min_time)
+        print(f"{name:>27}: {t * 1e9:10,.0f} ns/message")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+"""
+Compare the old Earley dice parser to the current LALR one.
+
+Run from the repo root:  python -m benchmarks.bench_parse
+"""
+import argparse
+
+import lark
+
+from dcabot.rolling import dice
+
+from .common import HERE, load_specs, time_per_call
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--min-time", type=float, default=1.0)
+    args = parser.parse_args()
+
+    specs = load_specs()
+
+    with open(HERE / "dice_earley.lark") as f:
+        earley = lark.Lark(f)
+
+    print(f"{len(specs)} specs")
+    results = {}
+    for name, fn in [("earley", earley.parse), ("lalr", dice.parse)]:
+        results[name] = t = time_per_call(fn, specs, min_time=args.min_time)
+        print(f"{name:>8}: {t * 1e6:8.1f} µs/spec  ({1 / t:8.0f} specs/s)")
+    print(f" speedup: {results['earley'] / results['lalr']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
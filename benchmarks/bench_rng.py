@@ -0,0 +1,48 @@
+"""
+Compare how many dice per second each RNG backend rolls, against random.randint.
+
+Run from the repo root:  python -m benchmarks.bench_rng
+"""
+import argparse
+import random
+
+from dcabot.rolling import dice, rng
+
+from .common import time_per_call
+
+POOLS = [(1, 20), (4, 6), (100, 6), (150, 10)]
+
+
+def stdlib(num, sides):
+    randint = random.randint
+    return [randint(1, sides) for _ in range(num)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--min-time", type=float, default=1.0)
+    args = parser.parse_args()
+
+    for num, sides in POOLS:
+        print(f"{num}d{sides}:")
+        t = time_per_call(lambda _: stdlib(num, sides), [None], min_time=args.min_time)
+        print(f"{'random.randint':>16}: {num / t:12,.0f} dice/s")
+
+        for backend in rng.BACKENDS:
+            r = rng.make_rng(backend)
+            t = time_per_call(
+                lambda _: r.randints(1, sides, num), [None], min_time=args.min_time
+            )
+            print(f"{backend:>16}: {num / t:12,.0f} dice/s")
+
+        # the whole roll, through the dice engine
+        roll = dice.get_dice_tree(f"{num}d{sides}")
+        fn = dice.compile_tree(roll)
+        for backend in rng.BACKENDS:
+            rng.set_rng(rng.make_rng(backend))
+            t = time_per_call(lambda _: fn(), [None], min_time=args.min_time)
+            print(f"{'roll, ' + backend:>16}: {num / t:12,.0f} dice/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Check that rolling exploding dice in bulk gives the same distribution as rolling them
+round by round, and time the two, to check which one eval() picks is the quicker.
+
+Run from the repo root:  python -m benchmarks.check_exploding
+
+Compares the totals, the number of dice rolled and the faces that came up, with a
+chi-squared test for each; prints FAIL (and exits with an error) if any of them look
+too different to be chance.
+"""
+import argparse
+import math
+import sys
+
+import numpy as np
+
+from dcabot.rolling import dice
+
+from .common import time_per_call
+
+CASES = [
+    ("d6 explode 6", dice.ExplodingDiceRoll(1, 6, 6)),
+    ("4d6 explode 5", dice.ExplodingDiceRoll(4, 6, 5)),
+    ("100d6 explode 2", dice.ExplodingDiceRoll(100, 6, 2)),
+    ("100d10 explode 5", dice.ExplodingDiceRoll(100, 10, 5)),
+    ("300d6 explode 4", dice.ExplodingDiceRoll(300, 6, 4)),
+    ("20d6 explode 7", dice.ExplodingDiceRoll(20, 6, 7)),
+    # around where eval() switches between them
+    ("16d10 explode 2", dice.ExplodingDiceRoll(16, 10, 2)),
+    ("500d6 explode 6", dice.ExplodingDiceRoll(500, 6, 6)),
+    ("1000d6 explode 6", dice.ExplodingDiceRoll(1000, 6, 6)),
+    ("1000d2 explode 2", dice.ExplodingDiceRoll(1000, 2, 2)),
+    # small caps, where the cap actually matters
+    ("5d2 explode 2, cap 3", dice.ExplodingDiceRoll(5, 2, 2, explosions_cap=3)),
+    ("40d3 explode 2, cap 1", dice.ExplodingDiceRoll(40, 3, 2, explosions_cap=1)),
+    ("10d4 explode 3, cap 0", dice.ExplodingDiceRoll(10, 4, 3, explosions_cap=0)),
+]
+
+# how many standard deviations off the chi-squared statistic can be before failing
+MAX_Z = 4
+
+
+def roll_rounds(roll):
+    return roll.roll_rounds()
+
+
+def roll_bulk(roll):
+    values, rounds = roll.roll_chains()
+    return values.tolist()
+
+
+def time_eval(roll, bulk, min_time):
+    "Seconds per eval() of roll, made to roll in bulk or not."
+    picked = roll.use_bulk
+    roll.use_bulk = bulk
+    try:
+        return time_per_call(dice.ExplodingDiceRoll.eval, [roll], min_time=min_time)
+    finally:
+        roll.use_bulk = picked
+
+
+def chi_squared_z(a, b):
+    """
+    Two-sample chi-squared test of whether samples a and b have the same distribution,
+    as a z-score (by the Wilson-Hilferty approximation). Rare values are lumped
+    together.
+    """
+    values = np.union1d(a, b)
+    counts = np.array(
+        [
+            np.bincount(np.searchsorted(values, x), minlength=len(values))
+            for x in [a, b]
+        ]
+    )
+    common = counts.sum(axis=0) >= 20
+    if not common.all():
+        counts = np.column_stack(
+            [counts[:, common], counts[:, ~common].sum(axis=1)]
+        )
+    dof = counts.shape[1] - 1
+    if dof == 0:
+        return 0.0
+
+    expected = (
+        counts.sum(axis=1, keepdims=True)
+        * counts.sum(axis=0, keepdims=True)
+        / counts.sum()
+    )
+    stat = ((counts - expected) ** 2 / expected).sum()
+    return ((stat / dof) ** (1 / 3) - (1 - 2 / (9 * dof))) / math.sqrt(2 / (9 * dof))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rolls", type=int, default=20_000)
+    parser.add_argument("--min-time", type=float, default=0.5)
+    args = parser.parse_args()
+
+    ok = True
+    for name, roll in CASES:
+        stats = {}
+        for how, fn in [("rounds", roll_rounds), ("bulk", roll_bulk)]:
+            rolls = [fn(roll) for _ in range(args.rolls)]
+            stats[how] = {
+                "total": [sum(r) for r in rolls],
+                "dice": [len(r) for r in rolls],
+                "faces": np.concatenate(rolls),
+            }
+
+        zs = {
+            stat: chi_squared_z(stats["rounds"][stat], stats["bulk"][stat])
+            for stat in ["total", "dice", "faces"]
+        }
+        failed = max(zs.values()) > MAX_Z
+        ok &= not failed
+
+        t_rounds = time_eval(roll, False, args.min_time)
+        t_bulk = time_eval(roll, True, args.min_time)
+        print(
+            f"{name:>22}:  "
+            + "  ".join(f"{stat} z={z:5.2f}" for stat, z in zs.items())
+            + f"  {'FAIL' if failed else 'ok  '}"
+            + f"   rounds {t_rounds * 1e6:7.1f}us  bulk {t_bulk * 1e6:7.1f}us"
+            + f"  eval picks {'bulk' if roll.use_bulk else 'rounds'}"
+        )
+
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
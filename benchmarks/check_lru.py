@@ -0,0 +1,63 @@
+"""
+Check that utils.LRUCache evicts the least recently used key, and counts hits.
+
+Run from the repo root:  python -m benchmarks.check_lru
+
+Prints FAIL (and exits with an error) if it keeps the wrong keys.
+"""
+import argparse
+import sys
+
+from dcabot.utils import LRUCache
+
+# (what to do, with which key), and the keys there should be afterwards
+CASES = [
+    ("abc", [], "abc"),
+    ("abcd", [], "bcd"),
+    ("abc", ["a"], "abc"),
+    ("abcde", [], "cde"),
+    # a was used after c was put in, so b and c go first
+    ("abc", ["a", "d", "e"], "ade"),
+    # putting a key in again counts as using it
+    ("abca", ["d"], "acd"),
+]
+
+
+def run(inserts, uses, size=3):
+    cache = LRUCache(size)
+    for key in inserts:
+        cache[key] = key.upper()
+    for key in uses:
+        if key in cache:
+            cache[key]
+        else:
+            cache[key] = key.upper()
+    return "".join(sorted(k for k in "abcdefgh" if k in cache))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.parse_args()
+
+    ok = True
+    for inserts, uses, expected in CASES:
+        got = run(inserts, uses)
+        passed = got == expected
+        ok &= passed
+        print(
+            f"put {inserts}, use {''.join(uses) or '-':>3}:  kept {got}"
+            f"{'' if passed else f', expected {expected}  FAIL'}"
+        )
+
+    cache = LRUCache(2)
+    cache["a"] = 1
+    counts = (cache.get("a"), cache.get("b"), cache.hits, cache.misses)
+    ok &= counts == (1, None, 1, 1)
+    print(f"hits and misses: {counts[2]} and {counts[3]}")
+
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
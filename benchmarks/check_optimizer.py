@@ -0,0 +1,126 @@
+"""
+Check that optimize.optimize() doesn't change anything but speed, and time it.
+
+Run from the repo root:  python -m benchmarks.check_optimizer
+
+For every spec in the corpus, plus some that are there to be simplified, checks:
+  display:  the replies to rolling it (with a fixed seed) are the same after
+            optimizing it as before, so the original tree wasn't touched
+  exact:    its exact distribution is the same, worked out with and without
+  sampled:  sampled values look the same, with a chi-squared test
+and prints how long sampling takes each way. Prints FAIL (and exits with an error)
+if anything differs.
+"""
+import argparse
+import sys
+
+import numpy as np
+
+from dcabot.rolling import dice, exact, optimize, rng
+from dcabot.rolling.render import roll_and_format
+
+from .check_exploding import MAX_Z, chi_squared_z
+from .common import load_specs, time_per_call
+
+EXTRA_SPECS = [
+    "d6 + d6",
+    "d6 + 2d6 + d6 - d6",
+    "-(-d6)",
+    "-(d6 - 3)",
+    "((d6 + 1) + 2) * 3",
+    "2 * (3 * (d6 * 4))",
+    "d6 / d4 / 2",
+    "1 / (1 / d6)",
+    "(d6 + d6)^1",
+    "(d20 + 5) - (d4 + 1) + d6 + d6",
+    "((((d6 + 1) + 1) + 1) + 1) * -1",
+    "d6 + d8 + d6 + d8 + 4d6>=5",
+    # comments are dropped from the optimized tree
+    "attack: (d20 + 5) + 2",
+    "d6 + d6 # fire",
+    "d6 #",
+]
+
+
+def parts(tree):
+    if isinstance(tree, dice.Concat):
+        return list(tree.args)
+    elif isinstance(tree, dice.Repeat):
+        return [tree.roll]
+    return [tree]
+
+
+def replies(tree):
+    with rng.seeded(0):
+        # not the "(top 8%)"s, which come and go as distributions are worked out
+        lines, _, _ = roll_and_format(tree, ranks=False)
+    return lines
+
+
+def same_distribution(a, b):
+    return (
+        a.values.shape == b.values.shape
+        and np.allclose(a.values, b.values, equal_nan=True)
+        and np.allclose(a.probs, b.probs, atol=1e-9)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--samples", type=int, default=20_000)
+    parser.add_argument("--min-time", type=float, default=0.2)
+    args = parser.parse_args()
+
+    ok = True
+    for spec in load_specs() + EXTRA_SPECS:
+        tree = dice.parse_dice_tree(spec)
+        before = replies(tree)
+        optimized = [optimize.optimize(part) for part in parts(tree)]
+        display_ok = replies(tree) == before
+
+        exact_ok = True
+        sample_z = 0.0
+        t_before = t_after = 0.0
+        for part, opt in zip(parts(tree), optimized):
+            if not dice.is_random(part):
+                continue
+            try:
+                exact_ok &= same_distribution(
+                    exact.tree_distribution(part), exact.tree_distribution(opt)
+                )
+            except exact.TooExpensiveError:
+                pass
+
+            gen = np.random.default_rng(1)
+            a, b = (
+                np.round(dice.sample_tree(t, args.samples, gen), 9) for t in [part, opt]
+            )
+            sample_z = max(sample_z, chi_squared_z(a, b))
+
+            t_before += time_per_call(
+                lambda t: dice.sample_tree(t, 1000, gen), [part], args.min_time
+            )
+            t_after += time_per_call(
+                lambda t: dice.sample_tree(t, 1000, gen), [opt], args.min_time
+            )
+
+        failed = not (display_ok and exact_ok) or sample_z > MAX_Z
+        ok &= not failed
+        shown = spec.replace("\n", "\\n")
+        if len(shown) > 40:
+            shown = shown[:39] + "…"
+        speedup = f"{t_before / t_after:5.2f}x" if t_after else "   - "
+        print(
+            f"{shown:>40}:  display {'ok' if display_ok else 'DIFF'}  "
+            f"exact {'ok' if exact_ok else 'DIFF'}  sampled z={sample_z:5.2f}  "
+            f"{'FAIL' if failed else 'ok  '}  sampling {speedup} faster"
+        )
+        if spec in EXTRA_SPECS:
+            print(f"{'':>42}{'  ;  '.join(str(opt) for opt in optimized)}")
+
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+Check that specs which can't be rolled are turned down as parse errors, which get a
+helpful reply, rather than failing part way through rolling ("Something broke").
+
+Run from the repo root:  python -m benchmarks.check_rejects
+
+Prints FAIL (and exits with an error) for any that parse, or fail some other way.
+"""
+import argparse
+import sys
+
+import lark
+
+from dcabot.rolling import dice
+from dcabot.rolling.render import roll_and_format
+
+REJECTED_SPECS = [
+    "0x d20",
+    "0x 0",
+    "00x d6",
+    "0x Goblin: d20+4 vs 15",
+    "d0",
+    "2d6 +",
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.parse_args()
+
+    ok = True
+    for spec in REJECTED_SPECS:
+        try:
+            roll_and_format(dice.parse_dice_tree(spec))
+        except lark.UnexpectedInput:
+            result = "ok    parse error"
+        except Exception as e:
+            result = f"FAIL  {type(e).__name__}: {e}"
+        else:
+            result = "FAIL  rolled"
+        ok &= result.startswith("ok")
+        print(f"{spec:>30}:  {result}")
+
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Stress-test spotlight trackers being changed from several places at once.
+
+Run from the repo root:  python -m benchmarks.check_spotlight
+
+Each "process" is a Spotlight cog with its own SpotlightStore on the same SQLite
+file, so they only know about each other's changes through it, like separate bot
+processes would. For each of a few channels at once, each round adds some people
+from all of them at once, then marks most people off from all of them at once; at
+the end of the round, the saved tracker has to have everyone added and exactly those
+people marked. Prints FAIL (and exits with an error) if any change was lost.
+"""
+import argparse
+import asyncio
+from pathlib import Path
+import random
+import sys
+import tempfile
+import time
+import types
+
+from dcabot import spotlight
+
+BOT_USER = object()
+
+
+class CountingStore(spotlight.SpotlightStore):
+    "A SpotlightStore that counts how many changes it turned down."
+
+    conflicts = 0
+
+    def swap(self, channel_id, version, text):
+        swapped = super().swap(channel_id, version, text)
+        if not swapped:
+            CountingStore.conflicts += 1
+        return swapped
+
+
+class FakeChannel:
+    def __init__(self, channel_id):
+        self.id = channel_id
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __eq__(self, other):
+        return self.id == other.id
+
+    async def history(self, limit):
+        for message in []:
+            yield message
+
+
+class FakeContext:
+    "Just enough of a commands.Context; sending takes a little while, like it would."
+
+    def __init__(self, channel, max_delay):
+        self.channel = channel
+        self.max_delay = max_delay
+
+    async def send(self, content=None, **kwargs):
+        await asyncio.sleep(random.uniform(0, self.max_delay))
+        if content and content.startswith("Sorry"):
+            print(f"gave up: {content}")
+
+    reply = send
+
+
+async def run_channel(cogs, channel, args):
+    names = [f"P{i:02}" for i in range(args.people)]
+    ctx = FakeContext(channel, args.max_delay)
+
+    async def on_any(command, *params):
+        cog = random.choice(cogs)
+        await getattr(cog, command)(FakeContext(channel, args.max_delay), *params)
+
+    failures = 0
+    for _ in range(args.rounds):
+        await cogs[0].start(ctx)
+        await asyncio.gather(*(on_any("add", name) for name in names))
+        marked = random.sample(names, random.randrange(1, len(names)))
+        await asyncio.gather(*(on_any("mark", name) for name in marked))
+
+        state, _ = await cogs[0].store.load(channel.id)
+        expected = {name: name in marked for name in names}
+        if state != expected:
+            failures += 1
+            print(f"FAIL: channel {channel.id}: got {state}, expected {expected}")
+    return failures
+
+
+def make_cog(path):
+    bot = types.SimpleNamespace(user=BOT_USER)
+    cog = spotlight.Spotlight(bot, store=CountingStore(path))
+    # what adding it to a bot would do, so commands can call each other
+    for command in cog.walk_commands():
+        command.cog = cog
+    return cog
+
+
+async def main_async(args, path):
+    cogs = [make_cog(path) for _ in range(args.processes)]
+    channels = [FakeChannel(i) for i in range(args.channels)]
+
+    start = time.perf_counter()
+    runs = [run_channel(cogs, channel, args) for channel in channels]
+    failures = sum(await asyncio.gather(*runs))
+    elapsed = time.perf_counter() - start
+
+    n_commands = args.channels * args.rounds * (1 + args.people * 2)
+    print(
+        f"{args.processes} processes, {args.channels} channels, {args.rounds} rounds: "
+        f"about {n_commands:,} commands in {elapsed:.1f}s, "
+        f"{CountingStore.conflicts:,} conflicts retried, {failures} lost changes"
+    )
+    for cog in cogs:
+        cog.store.close()
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--processes", type=int, default=3)
+    parser.add_argument("--channels", type=int, default=4)
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--people", type=int, default=12)
+    parser.add_argument("--max-delay", type=float, default=0.002)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        failures = asyncio.run(main_async(args, Path(tmp) / "spotlight.sqlite3"))
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
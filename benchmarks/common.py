@@ -0,0 +1,33 @@
+from pathlib import Path
+import time
+
+HERE = Path(__file__).parent
+
+
+def load_specs(path=HERE / "specs.txt"):
+    return [spec for specs in load_corpus(path).values() for spec in specs]
+
+
+def load_corpus(path=HERE / "specs.txt"):
+    "The specs, grouped by the '## name' line above them."
+    corpus = {}
+    name = "other"
+    with open(path) as f:
+        for line in f:
+            if line.startswith("## "):
+                name = line[3:].strip()
+            elif line.strip() and not line.startswith("#"):
+                spec = line.rstrip("\n").replace("\\n", "\n")
+                corpus.setdefault(name, []).append(spec)
+    return corpus
+
+
+def time_per_call(fn, args, min_time=1.0):
+    "Calls fn on each of args, repeatedly until min_time; returns seconds per call."
+    n = 0
+    start = time.perf_counter()
+    while (elapsed := time.perf_counter() - start) < min_time:
+        for arg in args:
+            fn(arg)
+        n += len(args)
+    return elapsed / n
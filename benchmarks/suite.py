@@ -0,0 +1,200 @@
+"""
+Benchmark each stage of ~roll separately, over each group of specs in the corpus.
+
+Run from the repo root:
+    python -m benchmarks.suite                        # just print the results
+    python -m benchmarks.suite --save baseline.json   # and save them
+    python -m benchmarks.suite --compare baseline.json
+
+The stages are:
+  parse:   spec -> dice tree (skipping the tree cache)
+  eval:    rolling the compiled tree
+  format:  the reply, as ~roll would send it
+  roll:    all of the above, the way ~roll does it (so with the tree cache)
+
+The distribution tables behind "(top 8%)" are built (in a temporary directory) and
+loaded as the bot does, and the distributions of everything else in the corpus are
+worked out before starting, so format measures the bot once it's warmed up.
+
+For each, it reports the time per spec (the best of REPEATS runs), and from
+tracemalloc, how many memory blocks per spec are still allocated after a pass with
+all the outputs kept, and the peak memory during that pass. --compare flags anything
+that's got slower, or allocates more, by more than the tolerances; and exits with an
+error if anything did.
+"""
+import argparse
+import gc
+import json
+import platform
+import sys
+import tempfile
+import tracemalloc
+
+from dcabot.rolling import dice, rng, tables
+from dcabot.rolling.render import format_repeat, format_result, pack_messages
+
+from .common import load_corpus, time_per_call
+
+# a result counts as a regression if it's this much slower...
+TIME_TOLERANCE = 0.25
+# ...or allocates this much more (and at least one more block per spec)
+ALLOC_TOLERANCE = 0.10
+# time each this many times, and keep the fastest, which is the least disturbed by
+# whatever else the machine is doing
+REPEATS = 3
+
+
+def format_lines(roll, result):
+    if isinstance(roll, dice.Repeat):
+        return format_repeat(roll, result)
+    if isinstance(roll, dice.Concat):
+        return [format_result(r, res) for r, res in zip(roll.args, result.args)]
+    return [format_result(roll, result)]
+
+
+def prepare_tables(corpus, path):
+    "Build and load the tables at path, and work out the rest of corpus's."
+    tables.build(path)
+    tables.load(path)
+    for specs in corpus.values():
+        for tree in map(dice.get_dice_tree, specs):
+            if isinstance(tree, dice.Repeat):
+                continue  # not ranked
+            for part in tree.args if isinstance(tree, dice.Concat) else [tree]:
+                if isinstance(part, dice.CommentedExpr):
+                    part = part.roll
+                if dice.is_random(part):
+                    tables.get_table(str(part))
+
+
+def get_stages():
+    def evaluate(tree):
+        return dice.compile_tree(tree)()
+
+    def format_reply(rolled):
+        tree, (_, result) = rolled
+        return pack_messages(format_lines(tree, result))
+
+    def roll(spec):
+        tree = dice.get_dice_tree(spec)
+        _, result = dice.compile_tree(tree)()
+        return pack_messages(format_lines(tree, result))
+
+    # each stage: (function, how to get its inputs from the specs)
+    return {
+        "parse": (dice.parse_dice_tree, lambda specs: specs),
+        "eval": (evaluate, lambda specs: [dice.get_dice_tree(s) for s in specs]),
+        "format": (
+            format_reply,
+            lambda specs: [
+                (tree, evaluate(tree)) for tree in map(dice.get_dice_tree, specs)
+            ],
+        ),
+        "roll": (roll, lambda specs: specs),
+    }
+
+
+def measure_memory(fn, args):
+    "Returns (blocks still allocated per call, peak bytes per call)."
+    gc.collect()
+    tracemalloc.start()
+    try:
+        kept = [fn(arg) for arg in args]
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    blocks = sum(stat.count for stat in snapshot.statistics("filename"))
+    del kept
+    return blocks / len(args), peak / len(args)
+
+
+def run(corpus, min_time):
+    results = {}
+    for stage, (fn, get_args) in get_stages().items():
+        for group, specs in corpus.items():
+            rng.set_rng(rng.make_rng("numpy", seed=0))
+            args = get_args(specs)
+            fn(args[0])  # warm up caches, compiled trees, etc
+            t = min(time_per_call(fn, args, min_time=min_time) for _ in range(REPEATS))
+            # same rolls each time, so the counts are comparable
+            rng.set_rng(rng.make_rng("numpy", seed=1))
+            blocks, peak = measure_memory(fn, args)
+            results[f"{stage}/{group}"] = {
+                "us_per_spec": t * 1e6,
+                "specs_per_s": 1 / t,
+                "blocks_per_spec": blocks,
+                "peak_bytes_per_spec": peak,
+            }
+            print(
+                f"{stage:>7} {group:>16}: {t * 1e6:9.1f} µs/spec {1 / t:10.0f}/s "
+                f"{blocks:9.1f} blocks {peak / 1024:9.1f} KiB peak",
+                flush=True,
+            )
+    return results
+
+
+def compare(results, baseline, time_tol=TIME_TOLERANCE, alloc_tol=ALLOC_TOLERANCE):
+    "Print how results differ from baseline; returns the keys that regressed."
+    regressed = []
+    print(f"\n{'':>24}   time vs baseline   blocks vs baseline")
+    for key, new in results.items():
+        old = baseline.get(key)
+        if old is None:
+            print(f"{key:>24}:  (not in baseline)")
+            continue
+
+        time_ratio = new["us_per_spec"] / old["us_per_spec"]
+        block_diff = new["blocks_per_spec"] - old["blocks_per_spec"]
+        flags = []
+        if time_ratio > 1 + time_tol:
+            flags.append("SLOWER")
+        if block_diff > max(1, alloc_tol * old["blocks_per_spec"]):
+            flags.append("MORE ALLOCATIONS")
+        if flags:
+            regressed.append(key)
+        print(
+            f"{key:>24}:  {time_ratio:14.2f}x   {block_diff:+16.1f}   {' '.join(flags)}"
+        )
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--min-time", type=float, default=0.5)
+    parser.add_argument("--save", metavar="FILE", help="save the results as JSON")
+    parser.add_argument("--compare", metavar="FILE", help="compare to saved results")
+    parser.add_argument("--time-tolerance", type=float, default=TIME_TOLERANCE)
+    parser.add_argument("--alloc-tolerance", type=float, default=ALLOC_TOLERANCE)
+    args = parser.parse_args()
+
+    corpus = load_corpus()
+    with tempfile.TemporaryDirectory() as tmp:
+        prepare_tables(corpus, f"{tmp}/dice_tables")
+        results = run(corpus, args.min_time)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(
+                {
+                    "python": sys.version,
+                    "machine": platform.platform(),
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressed = compare(
+            results, baseline["results"], args.time_tolerance, args.alloc_tolerance
+        )
+        if regressed:
+            print(f"\n{len(regressed)} regressions: {', '.join(regressed)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
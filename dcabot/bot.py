@@ -1,5 +1,6 @@
 import asyncio
 import logging
+import time
 
 import discord
 from discord.ext import commands
@@ -14,6 +15,15 @@ class DCABot(commands.Bot):
         command_prefix="~",
         add_when_mentioned=True,
         noprefix_dms=True,
+        dice_rng="numpy",
+        dice_rng_seed=None,
+        dice_limits=None,
+        dice_workers=0,
+        dice_timeout=10.0,
+        dice_macros_path="macros.sqlite3",
+        dice_tables_path="dice_tables",
+        spotlight_db_path="spotlight.sqlite3",
+        spotlight_edit_in_place=False,
         **kwargs,
     ):
         intents = discord.Intents.default()
@@ -40,11 +50,27 @@ class DCABot(commands.Bot):
             "dcabot.rolling",
             "dcabot.spotlight",
         ]
+        self.extension_load_times = {}
+        self.dice_rng = dice_rng
+        self.dice_rng_seed = dice_rng_seed
+        self.dice_limits = {} if dice_limits is None else dice_limits
+        self.dice_workers = dice_workers
+        self.dice_timeout = dice_timeout
+        self.dice_macros_path = dice_macros_path
+        self.dice_tables_path = dice_tables_path
+        self.spotlight_db_path = spotlight_db_path
+        self.spotlight_edit_in_place = spotlight_edit_in_place
+
+    async def timed_load_extension(self, ext):
+        start = time.perf_counter()
+        await self.load_extension(ext)
+        self.extension_load_times[ext] = time.perf_counter() - start
 
     async def setup_hook(self):
+        start = time.perf_counter()
         async with asyncio.TaskGroup() as tg:
             for ext in self.initial_extensions:
-                tg.create_task(self.load_extension(ext))
+                tg.create_task(self.timed_load_extension(ext))
 
             if self.base_prefix == "~":
                 # don't trigger if a message starts with ~~, i.e. is crossed out
@@ -52,5 +78,10 @@ class DCABot(commands.Bot):
                 async def noop(ctx):
                     pass
 
+        # extensions mostly import synchronously, so these add up to about the total
+        for ext, t in self.extension_load_times.items():
+            logging.info(f"Loaded {ext} in {t * 1000:.0f}ms")
+        logging.info(f"setup_hook took {(time.perf_counter() - start) * 1000:.0f}ms")
+
     async def on_ready(self):
         logging.info(f"Logged in as {self.user} ({self.user.id})")
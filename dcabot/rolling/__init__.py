@@ -1,34 +1,148 @@
+import asyncio
+import io
+import logging
+import re
+import typing
+
+import discord
 from discord.ext import commands
 import lark
 
-from . import dice
+from . import (
+    buttons,
+    cost,
+    dice,
+    exact,
+    history,
+    inline,
+    macros,
+    rng,
+    stats,
+    tables,
+    workers,
+)
+from .render import (
+    MAX_MESSAGES,
+    pack_messages,
+    parse_error_message,
+    roll_and_format,
+    too_much_message,
+)
+from ..utils import LRUCache
+
 
-# TODO: handle message (line?) length cap
+def stats_parts(roll):
+    "What to work out the statistics of for roll: each part of a list, or its own."
+    if isinstance(roll, dice.Concat):
+        return roll.args
+    elif isinstance(roll, dice.Repeat):
+        # rolling it again and again is what ~stats does anyway
+        return [roll.roll]
+    return [roll]
 
 
 class Rolling(commands.Cog):
-    def __init__(self, bot):
+    def __init__(self, bot, limits=None, pool=None, macro_store=None):
         self.bot = bot
+        self.limits = cost.Limits() if limits is None else limits
+        # a workers.DicePool to roll the expensive-looking things in, if any
+        self.pool = pool
+        self.histories = history.HistoryStore()
+        self.macros = macro_store
+        # the trees behind recent "Roll again" buttons, by spec
+        self.button_trees = LRUCache(buttons.MAX_BUTTONS)
+
+    async def cog_unload(self):
+        if self.pool is not None:
+            self.pool.stop()
+        if self.macros is not None:
+            self.macros.close()
+
+    async def reply_parse_error(self, ctx, spec, e):
+        await ctx.reply(parse_error_message(spec, e))
+
+    async def reply_broken(self, ctx, e):
+        m = "Something broke " + "\N{LOUDLY CRYING FACE}" * 3
+        if str(e):
+            m = m + f"\n```{e}```"
+        await ctx.reply(m)
+
+    async def reply_all(self, ctx, resps, file_resps=None, view=None):
+        """
+        Reply with each of resps, in as few messages as they fit in. If that's too
+        many, attach them as a file instead: file_resps, if given, is a function
+        giving a more detailed version for that. view, if given, goes on the last.
+        """
+        kwargs = {} if view is None else {"view": view}
+        messages = pack_messages(resps)
+        if len(messages) <= MAX_MESSAGES:
+            for i, message in enumerate(messages):
+                await ctx.reply(message, **(kwargs if i == len(messages) - 1 else {}))
+            return
+
+        text = "\n".join(file_resps() if file_resps is not None else resps)
+        await ctx.reply(
+            f"That's {len(resps)} results, too many for a message; here they are.",
+            file=discord.File(io.BytesIO(text.encode()), filename="results.txt"),
+            **kwargs,
+        )
+
+    def record(self, ctx, entries):
+        self.histories.record(ctx.author.id, ctx.channel.id, entries)
+
+    def roll_again_view(self, spec, roll=None):
+        "A Roll again button for spec, remembering its tree roll if given; or None."
+        view = buttons.make_view(spec)
+        if view is not None and roll is not None:
+            self.button_trees[dice.normalize_spec(spec)] = roll
+        return view
+
+    async def roll_in_pool(self, ctx, spec):
+        "Parse and roll spec in a worker process, giving up if it takes too long."
+        await ctx.defer()
+        try:
+            resps, file_resps, entries = await self.pool.roll(
+                spec, rng.get_rng().spawn()
+            )
+        except TimeoutError:
+            await ctx.reply(
+                f"Sorry, that was taking too long (over {self.pool.timeout:g} "
+                "seconds), so I gave up."
+            )
+            return
+        self.record(ctx, entries)
+        await self.reply_all(
+            ctx,
+            resps,
+            None if file_resps is None else lambda: file_resps,
+            self.roll_again_view(spec),
+        )
 
-    def format_result(self, roll, result):
-        if isinstance(roll, dice.CommentedExpr):
-            pre_comment = roll.pre_comment
-            post_comment = roll.post_comment
-            roll = roll.roll
+    async def roll_tree(self, ctx, spec, roll):
+        "Roll roll, parsed from spec, and reply with the results; or say why not."
+        estimate = cost.estimate(roll)
+        if problems := self.limits.problems(estimate):
+            await ctx.reply(too_much_message(problems))
+            return
+
+        if self.limits.is_cheap(estimate):
+            resps, file_resps, entries = roll_and_format(roll)
+        elif self.pool is not None:
+            await self.roll_in_pool(ctx, spec)
+            return
         else:
-            pre_comment = None
-            post_comment = None
+            # roll it in the background, so everything else can carry on meanwhile
+            await ctx.defer()
+            stream = rng.get_rng().spawn()
 
-        result_str = dice.get_result_str(roll)
+            def roll_in_thread():
+                with rng.using(stream):
+                    return roll_and_format(roll)
 
-        # TODO: prettier
-        s = f"{roll}    ::    {result_str}    ↠    **{result}**"
-        if pre_comment:
-            s = f"{pre_comment}:   {s}"
-        if post_comment:
-            s = f"{s}   # {post_comment}"
+            resps, file_resps, entries = await asyncio.to_thread(roll_in_thread)
 
-        return s
+        self.record(ctx, entries)
+        await self.reply_all(ctx, resps, file_resps, self.roll_again_view(spec, roll))
 
     @commands.hybrid_command(aliases=["r"])
     async def roll(
@@ -45,38 +159,396 @@ class Rolling(commands.Cog):
         #     await ctx.send(f"Rolling: {spec}")
 
         try:
-            roll = dice.get_dice_tree(spec)
-            result = dice.get_eval(roll)
-
-            if isinstance(roll, dice.Concat):
-                resp = "\n".join(
-                    self.format_result(r, res) for r, res in zip(roll.args, result)
-                )
+            if spec.startswith("!"):
+                macro = self.find_macro(ctx, spec)
+                if macro is None:
+                    await ctx.reply(f"Sorry, I don't know a macro called {spec}.")
+                    return
+                # already parsed; but if it has to go to a worker, that needs the text
+                spec, roll = macro.spec, macro.tree
+            elif self.pool is not None and not workers.looks_cheap(spec):
+                await self.roll_in_pool(ctx, spec)
+                return
             else:
-                resp = self.format_result(roll, result)
+                roll = dice.get_dice_tree(spec)
 
-            await ctx.reply(resp)
+            await self.roll_tree(ctx, spec, roll)
             # TODO: underflow / other reactions
 
         except lark.UnexpectedInput as e:
-            formatted = e.get_context(spec, span=100)
-            await ctx.reply(
-                f"""Sorry, I don't understand! I think the error might be here:
+            await self.reply_parse_error(ctx, spec, e)
+            return
+        except Exception as e:
+            await self.reply_broken(ctx, e)
+            raise e
+
+    @commands.Cog.listener()
+    async def on_interaction(self, interaction):
+        if interaction.type != discord.InteractionType.component:
+            return
+        spec = buttons.spec_from_custom_id(interaction.data.get("custom_id"))
+        if spec is None:
+            return
+
+        ctx = buttons.ButtonContext(interaction)
+        try:
+            roll = self.button_trees.get(spec)
+            if roll is None:
+                # not one we've seen since starting up: parse it again
+                if self.pool is not None and not workers.looks_cheap(spec):
+                    await self.roll_in_pool(ctx, spec)
+                    return
+                roll = dice.get_dice_tree(spec)
+            await self.roll_tree(ctx, spec, roll)
+
+        except lark.UnexpectedInput as e:
+            # the grammar might've changed since
+            await self.reply_parse_error(ctx, spec, e)
+        except Exception as e:
+            await self.reply_broken(ctx, e)
+            raise e
+
+    def roll_inline(self, specs):
+        """
+        Roll each of specs, as found in a message, for as long as that's quick; returns
+        (resps, entries) like roll_and_format().
+        """
+        resps = []
+        entries = []
+        for spec in specs:
+            try:
+                roll = dice.get_dice_tree(spec)
+            except lark.UnexpectedInput:
+                # people use [[...]] for other things too, like wiki links
+                continue
+            estimate = cost.estimate(roll)
+            if self.limits.problems(estimate) or not self.limits.is_cheap(estimate):
+                resps.append(f"`[[{spec}]]`: that's too much to roll here; try ~roll?")
+                continue
+            lines, _, roll_entries = roll_and_format(roll)
+            resps.extend(lines)
+            entries.extend(roll_entries)
+        return resps, entries
+
+    @commands.Cog.listener()
+    async def on_message(self, message):
+        "Roll anything in [[double brackets]] in ordinary messages."
+        if message.author.bot:
+            return
+        # this sees every message, so it has to turn down most of them quickly
+        specs = inline.find_specs(message.content)
+        if not specs:
+            return
+        # leave "~roll [[d6]]" and the like to the command
+        if (await self.bot.get_context(message)).valid:
+            return
+
+        try:
+            resps, entries = self.roll_inline(specs)
+            if not resps:
+                return
+            self.record(message, entries)
+            await self.reply_all(message, resps)
+        except Exception as e:
+            await self.reply_broken(message, e)
+            raise e
+
+    @commands.hybrid_command()
+    async def rollstats(
+        self,
+        ctx,
+        who: typing.Optional[discord.Member] = commands.parameter(
+            default=None, description="Whose rolls to look at (default: yours)"
+        ),
+        scope: typing.Literal["me", "channel"] = commands.parameter(
+            default="me", description="Or 'channel', for everyone's rolls in here"
+        ),
+    ):
+        "See how lucky someone's recent rolls have been."
+        if scope == "channel" and who is None:
+            histories, key = self.histories.channels, ctx.channel.id
+            name = "this channel"
+        else:
+            who = who or ctx.author
+            histories, key = self.histories.users, who.id
+            name = who.display_name
+
+        if key not in histories:
+            await ctx.reply(f"I haven't seen any rolls from {name} lately.")
+            return
+        # look at a copy, in case more rolls come in while we're working it out
+        snapshot = histories[key].copy()
+        try:
+            lines = await asyncio.to_thread(
+                history.summarize, self.histories.specs, snapshot
+            )
+        except Exception as e:
+            await self.reply_broken(ctx, e)
+            raise e
+
+        store = self.histories
+        lines = [f"**Rolls from {name}**", *lines]
+        lines.append(
+            f"-# (roll history: {store.nbytes / 2**20:.1f} MiB for "
+            f"{len(store.users)} users and {len(store.channels)} channels, "
+            f"at most {store.max_nbytes / 2**20:.0f} MiB)"
+        )
+        await self.reply_all(ctx, lines)
+
+    def find_macro(self, ctx, name):
+        "The user's macro called name, or failing that, the guild's; or None."
+        if self.macros is None:
+            return None
+        try:
+            name = macros.normalize_name(name)
+        except macros.MacroError:
+            return None
+        macro = self.macros.get(macros.USER, ctx.author.id, name)
+        if macro is None and ctx.guild is not None:
+            macro = self.macros.get(macros.GUILD, ctx.guild.id, name)
+        return macro
+
+    def macro_owner(self, ctx, scope):
+        return ctx.author.id if scope == macros.USER else ctx.guild.id
+
+    async def save_macro(self, ctx, scope, name, spec):
+        if self.macros is None:
+            await ctx.reply("Sorry, macros aren't set up here.")
+            return
+        try:
+            roll = dice.get_dice_tree(spec)
+            if problems := self.limits.problems(cost.estimate(roll)):
+                await ctx.reply(too_much_message(problems))
+                return
+            macro = await asyncio.to_thread(
+                self.macros.save, scope, self.macro_owner(ctx, scope), name, spec
+            )
+        except macros.MacroError as e:
+            await ctx.reply(f"Sorry, can't save that: {e}")
+        except lark.UnexpectedInput as e:
+            await self.reply_parse_error(ctx, spec, e)
+        else:
+            await ctx.reply(f"Saved `!{macro.name}`:  {macro.spec}")
+
+    async def list_macros(self, ctx, scope):
+        if self.macros is None:
+            await ctx.reply("Sorry, macros aren't set up here.")
+            return
+        owned = self.macros.owned(scope, self.macro_owner(ctx, scope))
+        whose = "Your" if scope == macros.USER else "This server's"
+        if not owned:
+            await ctx.reply(f"{whose} macros: none yet.")
+            return
+        await self.reply_all(
+            ctx,
+            [f"{whose} macros:"]
+            + [f"`!{name}`:  {owned[name].spec}" for name in sorted(owned)],
+        )
+
+    async def delete_macro(self, ctx, scope, name):
+        if self.macros is None:
+            await ctx.reply("Sorry, macros aren't set up here.")
+            return
+        try:
+            deleted = await asyncio.to_thread(
+                self.macros.delete, scope, self.macro_owner(ctx, scope), name
+            )
+        except macros.MacroError as e:
+            await ctx.reply(f"Sorry, can't delete that: {e}")
+            return
+        await ctx.reply(f"Deleted `!{name}`." if deleted else f"No macro `!{name}`.")
+
+    @commands.hybrid_group(invoke_without_command=True)
+    async def macro(self, ctx):
+        "Save dice to roll later with ~roll !name."
+        await self.list_macros(ctx, macros.USER)
+
+    @macro.command(name="save")
+    async def macro_save(
+        self,
+        ctx,
+        name: str = commands.parameter(description="What to call it"),
+        *,
+        spec: str = commands.parameter(description="The dice to roll"),
+    ):
+        "Save some dice as a macro of your own, to roll with ~roll !name."
+        await self.save_macro(ctx, macros.USER, name, spec)
+
+    @macro.command(name="list")
+    async def macro_list(self, ctx):
+        "List your macros."
+        await self.list_macros(ctx, macros.USER)
+
+    @macro.command(name="delete")
+    async def macro_delete(self, ctx, name: str):
+        "Delete one of your macros."
+        await self.delete_macro(ctx, macros.USER, name)
+
+    @commands.hybrid_group(invoke_without_command=True)
+    @commands.guild_only()
+    async def servermacro(self, ctx):
+        "Save dice for everyone here to roll with ~roll !name."
+        await self.list_macros(ctx, macros.GUILD)
+
+    @servermacro.command(name="save")
+    @commands.guild_only()
+    @commands.has_permissions(manage_guild=True)
+    async def servermacro_save(
+        self,
+        ctx,
+        name: str = commands.parameter(description="What to call it"),
+        *,
+        spec: str = commands.parameter(description="The dice to roll"),
+    ):
+        "Save some dice as a macro for everyone on this server."
+        await self.save_macro(ctx, macros.GUILD, name, spec)
+
+    @servermacro.command(name="list")
+    @commands.guild_only()
+    async def servermacro_list(self, ctx):
+        "List this server's macros."
+        await self.list_macros(ctx, macros.GUILD)
+
+    @servermacro.command(name="delete")
+    @commands.guild_only()
+    @commands.has_permissions(manage_guild=True)
+    async def servermacro_delete(self, ctx, name: str):
+        "Delete one of this server's macros."
+        await self.delete_macro(ctx, macros.GUILD, name)
+
+    @commands.hybrid_command()
+    async def stats(
+        self,
+        ctx,
+        *,
+        spec: str = commands.parameter(
+            description="The dice to roll, optionally followed by how many times"
+        ),
+    ):
+        "Roll something lots of times, and show how the results come out."
+        try:
+            try:
+                roll = dice.get_dice_tree(spec)
+                n_samples = stats.DEFAULT_SAMPLES
+            except lark.UnexpectedInput as e:
+                # maybe it ended with a number of samples, "4d6k3 10000"
+                if not (m := re.fullmatch(r"(.*\S)\s+([0-9_,]+)\s*", spec, re.DOTALL)):
+                    raise e
+                try:
+                    roll = dice.get_dice_tree(m.group(1))
+                except lark.UnexpectedInput:
+                    raise e from None
+                n_samples = int(m.group(2).replace(",", ""))
+
+            if not 0 < n_samples <= stats.MAX_SAMPLES:
+                await ctx.reply(
+                    f"Can do between 1 and {stats.MAX_SAMPLES:,} samples, sorry."
+                )
+                return
+
+            parts = stats_parts(roll)
+            stream = rng.get_rng().spawn()
 
-```
-{formatted}
+            def sample_in_thread():
+                with rng.using(stream):
+                    return [stats.sample(part, n_samples) for part in parts]
 
-{e}
-```"""
+            try:
+                # this can take a while; don't block everything else meanwhile
+                samples = await asyncio.to_thread(sample_in_thread)
+            except stats.TooBigError as e:
+                await ctx.reply(f"Sorry, that's too much for me! {e}")
+                return
+
+            await self.reply_all(
+                ctx,
+                [
+                    f"**{part}**, rolled {n_samples:,} times:\n{stats.summarize(s)}"
+                    for part, s in zip(parts, samples)
+                ],
             )
+
+        except lark.UnexpectedInput as e:
+            await self.reply_parse_error(ctx, spec, e)
             return
         except Exception as e:
-            m = "Something broke " + "\N{LOUDLY CRYING FACE}" * 3
-            if str(e):
-                m = m + f"\n```{e}```"
-            await ctx.reply(m)
+            await self.reply_broken(ctx, e)
             raise e
 
+    def describe_distribution(self, roll):
+        try:
+            dist = exact.distribution(roll)
+        except exact.TooExpensiveError as e:
+            n_samples = stats.DEFAULT_SAMPLES
+            try:
+                samples = stats.sample(roll, n_samples)
+            except stats.TooBigError as e2:
+                return f"**{roll}**: sorry, that's too much for me! ({e}; {e2})"
+            return (
+                f"**{roll}** is too complicated to work out exactly ({e}), "
+                f"so here's an estimate from rolling it {n_samples:,} times:\n"
+                + stats.summarize(samples)
+            )
+        return f"**{roll}**:\n" + stats.summarize_distribution(dist.values, dist.probs)
+
+    @commands.hybrid_command(aliases=["probs"])
+    async def prob(
+        self,
+        ctx,
+        *,
+        spec: str = commands.parameter(description="The dice to work out"),
+    ):
+        "Work out the exact chances of each result of a roll."
+        try:
+            roll = dice.get_dice_tree(spec)
+            parts = stats_parts(roll)
+            # (in case any of them has to be sampled)
+            stream = rng.get_rng().spawn()
+
+            def describe_in_thread():
+                with rng.using(stream):
+                    return [self.describe_distribution(part) for part in parts]
+
+            resps = await asyncio.to_thread(describe_in_thread)
+            await self.reply_all(ctx, resps)
+
+        except lark.UnexpectedInput as e:
+            await self.reply_parse_error(ctx, spec, e)
+            return
+        except Exception as e:
+            await self.reply_broken(ctx, e)
+            raise e
+
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def dicecache(self, ctx):
+        "Show how the parsed-dice cache is doing."
+        cache = dice.tree_cache
+        lookups = cache.hits + cache.misses
+        rate = f" ({cache.hits / lookups:.0%} hit rate)" if lookups else ""
+        await ctx.send(
+            f"{len(cache)} / {cache.max_size} trees cached; "
+            f"{cache.hits} hits, {cache.misses} misses{rate}"
+        )
+
 
 async def setup(bot):
-    await bot.add_cog(Rolling(bot))
+    rng.set_rng(rng.make_rng(bot.dice_rng, bot.dice_rng_seed))
+    limits = cost.Limits(**bot.dice_limits)
+    if bot.dice_macros_path:
+        macro_store = macros.MacroStore(bot.dice_macros_path)
+        n = await asyncio.to_thread(macro_store.load)
+        logging.info(f"Loaded {n} dice macros from {bot.dice_macros_path}")
+    else:
+        macro_store = None
+    if bot.dice_tables_path:
+        n = await asyncio.to_thread(tables.load_or_build, bot.dice_tables_path)
+        logging.info(f"Loaded {n} dice distribution tables from {bot.dice_tables_path}")
+    if bot.dice_workers:
+        pool = workers.DicePool(
+            bot.dice_workers, bot.dice_timeout, limits, bot.dice_tables_path or None
+        )
+        pool.start()
+    else:
+        pool = None
+    await bot.add_cog(Rolling(bot, limits, pool, macro_store))
@@ -0,0 +1,84 @@
+"""
+The "Roll again" button under ~roll replies.
+
+The button's custom_id has the expression in it, so a click can be handled even
+after the bot's restarted, by parsing that again. Until then, the cog keeps the
+parsed trees of recent buttons by their id (up to a limit), so clicking doesn't
+go near the parser.
+
+discord.py (as of 2.3) can only wait for clicks on persistent buttons with fixed
+ids, so the cog handles them all in an on_interaction listener instead; the views
+sent out are stopped first, so discord.py doesn't wait for clicks on them itself.
+"""
+import discord
+
+from . import dice
+from .render import MAX_MESSAGE_LEN
+
+PREFIX = "dcabot:roll-again:"
+MAX_CUSTOM_ID_LEN = 100  # Discord's limit
+# how many buttons' trees to keep around
+MAX_BUTTONS = 1024
+
+
+def custom_id(spec):
+    "The custom_id of a button to roll spec again; None if spec is too long for one."
+    custom_id = PREFIX + dice.normalize_spec(spec)
+    return custom_id if len(custom_id) <= MAX_CUSTOM_ID_LEN else None
+
+
+def spec_from_custom_id(custom_id):
+    "The spec to roll again for a button's custom_id; None if it's not one of ours."
+    if custom_id is None or not custom_id.startswith(PREFIX):
+        return None
+    return custom_id.removeprefix(PREFIX)
+
+
+def make_view(spec):
+    "A View with a button to roll spec again, or None if it can't have one."
+    if (cid := custom_id(spec)) is None:
+        return None
+    view = discord.ui.View(timeout=None)
+    view.add_item(
+        discord.ui.Button(
+            label="Roll again",
+            emoji="\N{GAME DIE}",
+            style=discord.ButtonStyle.secondary,
+            custom_id=cid,
+        )
+    )
+    view.stop()
+    return view
+
+
+class ButtonContext:
+    """
+    Enough of a commands.Context to roll things for a button click: the first reply
+    answers the click, and any more follow it up.
+    """
+
+    def __init__(self, interaction):
+        self.interaction = interaction
+        self.author = interaction.user
+        self.channel = interaction.channel
+        self.guild = interaction.guild
+        self.replied = False
+
+    async def defer(self):
+        if not self.interaction.response.is_done():
+            await self.interaction.response.defer(thinking=True)
+
+    async def reply(self, content=None, **kwargs):
+        if not self.replied:
+            # say who it was, since this isn't a reply to their own message
+            header = f"{self.author.mention} rolled again:"
+            if content is None:
+                content = header
+            elif len(header) + 1 + len(content) <= MAX_MESSAGE_LEN:
+                content = f"{header}\n{content}"
+            kwargs.setdefault("allowed_mentions", discord.AllowedMentions.none())
+            self.replied = True
+        if not self.interaction.response.is_done():
+            await self.interaction.response.send_message(content, **kwargs)
+        else:
+            await self.interaction.followup.send(content, **kwargs)
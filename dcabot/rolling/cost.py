@@ -0,0 +1,185 @@
+"""
+Rough estimates of how much work rolling a dice expression takes, and how big the
+result could be, without rolling anything; and limits on those.
+
+The estimates are high-probability upper bounds rather than exact: exploding dice
+count as their expected number plus six standard deviations (or the cap, if that's
+less), and values as if every die came up as its highest face.
+"""
+import math
+
+from . import dice
+
+LOG10_2 = math.log10(2)
+
+
+class Cost:
+    def __init__(self, dice=0, work=0, value_bits=0.0, output_chars=0):
+        self.dice = dice  # how many dice get rolled
+        self.work = work  # roughly how many steps that takes
+        self.value_bits = value_bits  # log2 of the biggest the value could be
+        self.output_chars = output_chars  # shortest reply we could give about it
+
+    def __repr__(self):
+        return (
+            f"Cost(dice={self.dice:.0f}, work={self.work:.0f}, "
+            f"value_bits={self.value_bits:.1f}, output_chars={self.output_chars})"
+        )
+
+    @property
+    def value_digits(self):
+        return self.value_bits * LOG10_2
+
+
+class Limits:
+    """
+    How much we're willing to do for one roll: anything over the max_ limits is
+    turned down, and anything more than inline_work steps is rolled in the background
+    instead of on the event loop.
+    """
+
+    def __init__(
+        self,
+        max_dice=10**9,
+        max_work=2_000_000,
+        max_value_digits=1000,
+        max_output_chars=200_000,
+        inline_work=20_000,
+    ):
+        self.max_dice = max_dice
+        self.max_work = max_work
+        self.max_value_digits = max_value_digits
+        self.max_output_chars = max_output_chars
+        self.inline_work = inline_work
+
+    def problems(self, cost):
+        "What's wrong with cost, as a list of explanations; empty if it's fine."
+        problems = []
+        if cost.dice > self.max_dice:
+            problems.append(
+                f"it'd roll {format_amount(cost.dice)} dice "
+                f"(the most I'll do is {self.max_dice:,})"
+            )
+        if cost.work > self.max_work:
+            problems.append(
+                f"it'd take {format_amount(cost.work)} steps "
+                f"(the most I'll do is {self.max_work:,})"
+            )
+        if cost.value_digits > self.max_value_digits:
+            problems.append(
+                f"the answer could have {format_amount(cost.value_digits)} digits "
+                f"(the most I'll do is {self.max_value_digits:,})"
+            )
+        if cost.output_chars > self.max_output_chars:
+            problems.append(
+                f"the reply would be {format_amount(cost.output_chars)} characters "
+                f"long (the most I'll do is {self.max_output_chars:,})"
+            )
+        return problems
+
+    def is_cheap(self, cost):
+        return cost.work <= self.inline_work
+
+
+def format_amount(x):
+    return f"about {x:,.0f}" if math.isfinite(x) else "uncountably many"
+
+
+def log2_abs(x):
+    return math.log2(abs(x)) if x else 0.0
+
+
+def dice_bound(roll):
+    "A high-probability upper bound on how many dice roll rolls, explosions and all."
+    if isinstance(roll, dice.ExplodingDiceRoll):
+        explode_chance = 1 - roll.max_stop_face / roll.sides
+        if explode_chance == 0:
+            return roll.num
+        mean = roll.num / (1 - explode_chance)
+        sd = math.sqrt(roll.num * explode_chance) / (1 - explode_chance)
+        return min(mean + 6 * sd, roll.num * (roll.explosions_cap + 1))
+    return roll.num + getattr(roll, "num_reroll", 0)
+
+
+def roll_work(roll, n_dice):
+    if roll.use_counts and not isinstance(roll, dice.ExplodingDiceRoll):
+        # a multinomial draw or two, then going through the faces
+        return 2 * roll.sides
+    return n_dice
+
+
+def estimate(obj):
+    "The Cost of rolling obj: a dice tree or a number."
+    cost = _estimate(obj)
+    # and the reply shows the expression itself
+    cost.output_chars += len(str(obj))
+    return cost
+
+
+def _estimate(obj):
+    if isinstance(obj, dice.DiceRoll):
+        n_dice = dice_bound(obj)
+        value_bits = log2_abs(n_dice * obj.sides)
+        return Cost(
+            dice=n_dice,
+            work=roll_work(obj, n_dice),
+            value_bits=value_bits,
+            output_chars=math.ceil(value_bits * LOG10_2) + 7,
+        )
+
+    elif isinstance(obj, dice.NumHits):
+        cost = _estimate(obj.roll)
+        if not obj.roll.use_counts:
+            cost.work += cost.dice
+        cost.value_bits = log2_abs(cost.dice)
+        cost.output_chars += 5
+        return cost
+
+    elif isinstance(obj, dice.MathOp):
+        args = [_estimate(arg) for arg in obj.args]
+        if obj.op == dice.Op.SUM:
+            value_bits = max(a.value_bits for a in args) + math.log2(len(args))
+        elif obj.op == dice.Op.PROD:
+            value_bits = sum(abs(a.value_bits) for a in args)
+        else:
+            assert obj.op == dice.Op.POW
+            base, exp = args
+            # |a^b| <= |a|^max|b|, or for |a| < 1, (1/|a|)^max|b|
+            value_bits = abs(base.value_bits) * 2.0 ** min(exp.value_bits, 1000)
+        return Cost(
+            dice=sum(a.dice for a in args),
+            work=sum(a.work for a in args),
+            value_bits=value_bits,
+            output_chars=sum(a.output_chars for a in args) + 5 * len(args),
+        )
+
+    elif isinstance(obj, dice.CommentedExpr):
+        return _estimate(obj.roll)
+
+    elif isinstance(obj, dice.Repeat):
+        cost = _estimate(obj.roll)
+        if obj.detailed:
+            # a line in the table for each, then the summary
+            output_chars = obj.times * (cost.output_chars + cost.value_digits + 20)
+        else:
+            output_chars = 0
+        return Cost(
+            dice=cost.dice * obj.times,
+            work=cost.work * obj.times,
+            value_bits=cost.value_bits,
+            output_chars=output_chars + 3 * cost.value_digits + 80,
+        )
+
+    elif isinstance(obj, dice.Concat):
+        args = [_estimate(arg) for arg in obj.args]
+        return Cost(
+            dice=sum(a.dice for a in args),
+            work=sum(a.work for a in args),
+            value_bits=max(a.value_bits for a in args),
+            # each of them goes on its own line, with its value
+            output_chars=sum(a.output_chars + a.value_digits + 10 for a in args),
+        )
+
+    else:
+        value_bits = log2_abs(obj)
+        return Cost(value_bits=value_bits, output_chars=len(str(obj)))
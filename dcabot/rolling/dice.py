@@ -1,14 +1,62 @@
+import collections
 import enum
+import functools
+import itertools
+import math
 import numbers
 import operator
 from pathlib import Path
-import random
 
 import lark
+import numpy as np
 
+from ..utils import LRUCache
+from .rng import get_rng
+
+
+# Building the LALR tables is most of the import time, so lark pickles them to a file
+# in the temp dir, named by a hash of the grammar, options and lark version; that
+# gets rebuilt automatically whenever any of those change.
+PARSER_OPTIONS = dict(parser="lalr", lexer="contextual", cache=True)
 
 with open(Path(__file__).parent / "dice.lark") as f:
-    parser = lark.Lark(f)  # grammar apparently isn't LALR, not sure why not but oh well
+    grammar = f.read()
+parser = lark.Lark(grammar, **PARSER_OPTIONS)
+
+# The grammar is careful about when a comment can swallow a comma, so that lists work.
+# But the old (Earley) parser would let a comment take everything up to its colon if
+# nothing else made sense; if the strict version fails, try that before giving up.
+LENIENT_PRECOMMENT = r"""
+%override PRECOMMENT.3: /[^:#\n`]+(?=:)/
+"""
+
+
+@functools.cache
+def get_lenient_parser():
+    return lark.Lark(grammar + LENIENT_PRECOMMENT, **PARSER_OPTIONS)
+
+
+def parse(spec):
+    try:
+        return parser.parse(spec)
+    except lark.UnexpectedInput as e:
+        try:
+            return get_lenient_parser().parse(spec)
+        except lark.UnexpectedInput:
+            raise e from None
+
+
+# integer powers of constants with more bits than this aren't worked out while parsing
+MAX_FOLD_BITS = 4096
+
+
+def is_huge_pow(a, b):
+    return (
+        isinstance(a, int)
+        and isinstance(b, int)
+        and abs(a) > 1
+        and b * abs(a).bit_length() > MAX_FOLD_BITS
+    )
 
 
 # transforms the parse tree into an abstract dice tree, classes below
@@ -16,8 +64,8 @@ class DiceTreeExtractor(lark.Transformer):
     def POSINT(self, tok):
         return int(tok)
 
-    def NATURAL(self, tok):
-        return int(tok)
+    def ZERO(self, tok):
+        return 0
 
     def DECIMAL(self, tok):
         return float(tok)
@@ -75,6 +123,9 @@ class DiceTreeExtractor(lark.Transformer):
         a, b = args
         if is_random(a) or is_random(b):
             return MathOp(Op.POW, [a, b])
+        elif is_huge_pow(a, b):
+            # leave it for the cost check to turn down, rather than working it out
+            return MathOp(Op.POW, [a, b])
         else:
             return a**b
 
@@ -170,12 +221,47 @@ class DiceTreeExtractor(lark.Transformer):
     def list(self, args):
         return Concat(args)
 
+    def REPEAT(self, tok):
+        return int(tok.rstrip("xX \t"))
+
+    def repeat(self, args):
+        times, pre_comment, expr, thresh, post_comment = args
+        if pre_comment or post_comment:
+            expr = CommentedExpr(
+                expr,
+                pre_comment=pre_comment.strip() if pre_comment else None,
+                post_comment=post_comment.strip() if post_comment else None,
+            )
+        return Repeat(expr, times, thresh)
+
+    list_nl = list
+
 
 transformer = DiceTreeExtractor()
 
 
+# The trees below are never modified after they're built, so we can hang on to them;
+# people tend to roll the same few things over and over.
+tree_cache = LRUCache(1024)
+
+
+def normalize_spec(spec):
+    # whitespace is ignored, except inside comments (and newlines are separators);
+    # the ends of comments get stripped anyway, so this is the safe bit
+    return spec.strip(" \t")
+
+
 def get_dice_tree(spec):
-    parse_tree = parser.parse(spec)
+    key = normalize_spec(spec)
+    tree = tree_cache.get(key)
+    if tree is None:
+        # parse what we were given, so error positions line up with it
+        tree_cache[key] = tree = parse_dice_tree(spec)
+    return tree
+
+
+def parse_dice_tree(spec):
+    parse_tree = parse(spec)
     if isinstance(parse_tree, lark.Token):  # trasform crashes, bug in lark I guess
         return transformer._call_userfunc_token(parse_tree)
     else:
@@ -184,18 +270,124 @@ def get_dice_tree(spec):
 
 ################################################################################
 # Abstract dice trees
+#
+# These are immutable descriptions of what to roll. Calling eval() on one rolls the
+# dice and returns a separate result object, with the value in .value and a
+# description of what happened from .result_str(); constants are their own results.
+# The dice come from rng.get_rng(), which can be swapped out or seeded.
+#
+# eval() walks the tree each time; for rolling the same thing repeatedly,
+# compile_tree() gives a function that does the same without any of that dispatch.
+#
+# For statistics, sample(n, rng) rolls the whole thing n times at once with numpy,
+# returning an array of n values; dice-rolling nodes also have sample_dice(n, rng),
+# giving an (n, num_dice) array of faces and a mask of which ones were kept (or None
+# if all of them were). Those only give values, not result objects.
+#
+# Big pools of dice (at least COUNTS_MIN_DICE of them, and at least as many as they
+# have sides) are rolled as how many came up as each face, with a multinomial draw,
+# rather than die by die; they give a DiceCountsResult, where keeping and counting
+# hits take time proportional to the number of sides.
+#
+# result_str(style, budget) can describe a result in less detail, for huge pools of
+# dice: with a budget, it returns None rather than anything longer than that, and
+# stops building the string as soon as it knows it won't fit.
+
+
+class Style(enum.IntEnum):
+    FULL = 0  # every single die
+    SUMMARY = 1  # how many of each face
+    TOTAL = 2  # just the totals
+
+
+def fit(s, budget):
+    return s if budget is None or len(s) <= budget else None
+
+
+def join_within(sep, bits, budget):
+    "sep.join(bits), or None if that'd be longer than budget (without finishing)."
+    if budget is None:
+        return sep.join(bits)
+    out = []
+    length = -len(sep)
+    for bit in bits:
+        length += len(sep) + len(bit)
+        if length > budget:
+            return None
+        out.append(bit)
+    return sep.join(out)
 
 
 def is_random(obj):
     return getattr(obj, "is_random", False)
 
 
-def get_eval(obj):
+def get_result(obj):
     return obj.eval() if hasattr(obj, "eval") else obj
 
 
-def get_result_str(obj):
-    return obj.result_str() if hasattr(obj, "result_str") else str(obj)
+def get_value(result):
+    return result.value if hasattr(result, "value") else result
+
+
+def get_result_str(result, style=Style.FULL, budget=None):
+    if hasattr(result, "result_str"):
+        return result.result_str(style, budget)
+    return fit(str(result), budget)
+
+
+def render_result(result, budget=None):
+    "The most detailed description of result that fits in budget, or None if none do."
+    for style in Style:
+        s = get_result_str(result, style, budget)
+        if s is not None:
+            return s
+    return None
+
+
+def get_eval(obj):
+    return get_value(get_result(obj))
+
+
+def sample_tree(obj, n, rng):
+    return obj.sample(n, rng) if hasattr(obj, "sample") else np.full(n, obj)
+
+
+COUNTS_MIN_DICE = 200
+# repeating something more than this many times only gives the values, not results
+REPEAT_DETAIL_MAX = 25
+# roll exploding dice with numpy when the dice we expect to roll, plus BULK_ROUND_DICE
+# for each round of explosions we expect, come to at least BULK_MIN_DICE: numpy has a
+# bigger fixed cost, but less per die, and none per round (see
+# benchmarks.check_exploding)
+BULK_MIN_DICE = 1200
+BULK_ROUND_DICE = 55
+
+
+def keep_counts(counts, k, highest):
+    "Which of counts (by face) to keep, to keep the k highest or lowest dice."
+    kept = [0] * len(counts)
+    faces = range(len(counts) - 1, -1, -1) if highest else range(len(counts))
+    for i in faces:
+        if k <= 0:
+            break
+        kept[i] = min(counts[i], k)
+        k -= kept[i]
+    return kept
+
+
+def add_counts(a, b):
+    return [x + y for x, y in zip(a, b)]
+
+
+def compile_tree(obj):
+    """
+    Get a function which rolls obj, returning (value, result) with result as in
+    get_result(obj). It's built once per tree node and then reused.
+    """
+    if hasattr(obj, "compiled"):
+        return obj.compiled
+    return lambda: (obj, obj)
 
 
 class DiceRoll:
@@ -205,32 +397,131 @@ class DiceRoll:
         self.num = num
         self.sides = sides
         self.is_random = True
+        self.use_counts = num >= max(COUNTS_MIN_DICE, sides)
 
     def __str__(self):
         return f"d{self.sides}" if self.num == 1 else f"{self.num}d{self.sides}"
 
+    def roll_dice(self, n):
+        return get_rng().randints(1, self.sides, n)
+
+    def roll_counts(self, n):
+        "Roll n dice, returning how many came up as each face (indexed by face - 1)."
+        probs = np.full(self.sides, 1 / self.sides)
+        return get_rng().numpy.multinomial(n, probs).tolist()
+
     def eval(self):
-        self.results = [random.randint(1, self.sides) for _ in range(self.num)]
-        self.inds_to_keep = frozenset(range(len(self.results)))
-        return self._set_total()
+        if self.use_counts:
+            return DiceCountsResult(self, self.roll_counts(self.num))
+        return DiceRollResult(self, self.roll_dice(self.num))
+
+    @functools.cached_property
+    def compiled(self):
+        if type(self) is DiceRoll and not self.use_counts:
+            num, sides = self.num, self.sides
+
+            def roll():
+                result = DiceRollResult(self, get_rng().randints(1, sides, num))
+                return result.value, result
 
-    def _set_total(self):
-        self.total = sum(
+            return roll
+
+        # the various subclasses' eval()s are already just one straight-line function
+        evaluate = self.eval
+
+        def roll():
+            result = evaluate()
+            return result.value, result
+
+        return roll
+
+    def format_die(self, r, kept):
+        return str(r) if kept else f"~~{r}~~"
+
+    def sample_dice(self, n, rng):
+        return rng.integers(1, self.sides, size=(n, self.num), endpoint=True), None
+
+    def sample(self, n, rng):
+        if self.use_counts:
+            # just how many came up as each face, as in eval(), rather than every die
+            probs = np.full(self.sides, 1 / self.sides)
+            counts = rng.multinomial(self.num, probs, size=n)
+            return counts @ np.arange(1, self.sides + 1)
+        values, kept = self.sample_dice(n, rng)
+        if kept is not None:
+            values = np.where(kept, values, 0)
+        return values.sum(axis=1)
+
+
+class DiceRollResult:
+    def __init__(self, roll, results, inds_to_keep=None):
+        self.roll = roll
+        self.results = results
+        self.num_dice = len(results)
+        if inds_to_keep is None:
+            self.inds_to_keep = frozenset(range(len(results)))
+            self.value = self.total = sum(results)
+        else:
+            self.inds_to_keep = inds_to_keep
+            self.value = self.total = sum(
+                r for i, r in enumerate(results) if i in inds_to_keep
+            )
+
+    def format_single_roll(self, i, r):
+        return self.roll.format_die(r, i in self.inds_to_keep)
+
+    def die_strs(self):
+        return (self.format_single_roll(i, r) for i, r in enumerate(self.results))
+
+    def face_counts(self):
+        "How many of each face were kept, highest first, and how many were dropped."
+        counts = collections.Counter(
             r for i, r in enumerate(self.results) if i in self.inds_to_keep
         )
-        return self.total
+        return sorted(counts.items(), reverse=True), self.num_dice - counts.total()
 
-    def format_single_roll(self, i, r):
-        return str(r) if i in self.inds_to_keep else f"~~{r}~~"
+    def result_str(self, style=Style.FULL, budget=None):
+        if self.num_dice == 1 or style == Style.TOTAL:
+            return fit(f"(**{self.total}**)", budget)
 
-    def result_str(self):
-        if not hasattr(self, "results"):
-            raise ValueError("Roll the dice with eval() first")
-        if len(self.results) == 1:
-            return f"(**{self.results[0]}**)"
+        end = f" => **{self.total}**)"
+        room = None if budget is None else budget - len(end) - 1
+        if style == Style.FULL:
+            bits = self.die_strs()
         else:
-            bits = [self.format_single_roll(i, r) for i, r in enumerate(self.results)]
-            return f"({' + '.join(bits)} => **{self.total}**)"
+            counts, n_dropped = self.face_counts()
+            bits = (f"{n}×{self.roll.format_die(r, True)}" for r, n in counts)
+            if n_dropped:
+                bits = itertools.chain(bits, [f"~~{n_dropped} dropped~~"])
+        joined = join_within(" + ", bits, room)
+        return None if joined is None else f"({joined}{end}"
+
+
+class DiceCountsResult(DiceRollResult):
+    """
+    A DiceRollResult that only knows how many dice came up as each face: counts[i]
+    rolled i + 1, and kept[i] of those were kept.
+    """
+
+    def __init__(self, roll, counts, kept=None):
+        self.roll = roll
+        self.counts = counts
+        self.kept = counts if kept is None else kept
+        self.num_dice = sum(counts)
+        self.value = self.total = sum(
+            face * n for face, n in enumerate(self.kept, start=1)
+        )
+
+    def die_strs(self):
+        # highest first, then the dropped ones
+        for kept in [True, False]:
+            for i in range(len(self.counts) - 1, -1, -1):
+                n = self.kept[i] if kept else self.counts[i] - self.kept[i]
+                yield from itertools.repeat(self.roll.format_die(i + 1, kept), n)
+
+    def face_counts(self):
+        counts = [(i + 1, n) for i, n in enumerate(self.kept) if n]
+        return counts[::-1], self.num_dice - sum(self.kept)
 
 
 class ExplodingDiceRoll(DiceRoll):
@@ -243,29 +534,118 @@ class ExplodingDiceRoll(DiceRoll):
                 "Must explode on at least 2 to avoid infinite dice..."
                 f"got {explode_thresh}"
             )
+        # the highest face that doesn't explode
+        self.max_stop_face = min(explode_thresh - 1, self.sides)
+        self.explode_chance = 1 - self.max_stop_face / self.sides
+        # on average, we roll num * sides / max_stop_face dice (ignoring the cap), in
+        # about as many rounds as the longest of num chains of explosions
+        expected_dice = self.num * self.sides / self.max_stop_face
+        expected_rounds = 1
+        if self.explode_chance > 0:
+            expected_rounds += min(
+                math.log(max(self.num, 1)) / -math.log(self.explode_chance),
+                self.explosions_cap,
+            )
+        self.use_bulk = (
+            expected_dice + BULK_ROUND_DICE * expected_rounds >= BULK_MIN_DICE
+        )
 
     def __str__(self):
         return f"{super().__str__()} explode {self.explode_thresh}"
 
-    def eval(self):
-        new_results = [random.randint(1, self.sides) for _ in range(self.num)]
-        self.results = new_results.copy()
+    def roll_chains(self):
+        """
+        Roll all the dice, explosions and all, in bulk. Returns (values, rounds): an
+        array of every die rolled, and which round of explosions each came from.
+
+        Each die sets off a geometrically-distributed number of explosions (up to the
+        cap), so draw those first: then each die's chain is that many exploding
+        faces, and a last one that doesn't explode, or could be anything if it's
+        where the cap cut it off.
+        """
+        np_rng = get_rng().numpy
+        if self.explode_chance > 0:
+            n_explosions = np_rng.geometric(1 - self.explode_chance, size=self.num) - 1
+            np.minimum(n_explosions, self.explosions_cap, out=n_explosions)
+        else:
+            n_explosions = np.zeros(self.num, dtype=np.int64)
+        lengths = n_explosions + 1
+        ends = np.cumsum(lengths) - 1
+        rounds = np.arange(ends[-1] + 1)
+        rounds -= np.repeat(ends - n_explosions, lengths)
+
+        values = np.empty(len(rounds), dtype=np.int64)
+        last = np.zeros(len(rounds), dtype=bool)
+        last[ends] = True
+        if self.explode_chance > 0:
+            values[~last] = np_rng.integers(
+                self.explode_thresh,
+                self.sides,
+                size=len(rounds) - self.num,
+                endpoint=True,
+            )
+        capped = n_explosions == self.explosions_cap
+        values[last] = np_rng.integers(
+            1, np.where(capped, self.sides, self.max_stop_face), endpoint=True
+        )
+        return values, rounds
+
+    def roll_rounds(self):
+        "Roll the dice round by round, which is quicker when there aren't many."
+        new_results = self.roll_dice(self.num)
+        results = new_results.copy()
         for explode_iter in range(self.explosions_cap):
             # do any relevant games say "explode <= 10 dice" or something?
             n_to_explode = sum(1 for r in new_results if r >= self.explode_thresh)
             if n_to_explode == 0:
                 break
-            new_results = [random.randint(1, self.sides) for _ in range(n_to_explode)]
-            self.results.extend(new_results)
+            new_results = self.roll_dice(n_to_explode)
+            results.extend(new_results)
         else:
             pass  # could warn that we hit the explosions cap
+        return results
 
-        self.inds_to_keep = frozenset(range(len(self.results)))
-        return self._set_total()
+    def eval(self):
+        if not self.use_bulk:
+            return DiceRollResult(self, self.roll_rounds())
 
-    def format_single_roll(self, i, r):
+        values, rounds = self.roll_chains()
+        if self.use_counts:
+            counts = np.bincount(values, minlength=self.sides + 1)[1:]
+            return DiceCountsResult(self, counts.tolist())
+        # in the same order as rolling them round by round would give
+        return DiceRollResult(self, values[np.argsort(rounds, kind="stable")].tolist())
+
+    def format_die(self, r, kept):
         return f"_{r}_" if r >= self.explode_thresh else str(r)
 
+    def _sample_rounds(self, n, rng):
+        # yields (values, mask) for each round of explosions; rows are padded out to
+        # the biggest number of explosions in that round, with zeros masked out
+        new = rng.integers(1, self.sides, size=(n, self.num), endpoint=True)
+        yield new, None
+        n_to_explode = (new >= self.explode_thresh).sum(axis=1)
+        for explode_iter in range(self.explosions_cap):
+            width = n_to_explode.max(initial=0)
+            if width == 0:
+                break
+            new = rng.integers(1, self.sides, size=(n, width), endpoint=True)
+            mask = np.arange(width) < n_to_explode[:, np.newaxis]
+            new[~mask] = 0
+            yield new, mask
+            n_to_explode = (new >= self.explode_thresh).sum(axis=1)
+
+    def sample_dice(self, n, rng):
+        values, masks = zip(*self._sample_rounds(n, rng))
+        if len(values) == 1:
+            return values[0], None
+        masks = [np.ones_like(values[0], dtype=bool), *masks[1:]]
+        return np.concatenate(values, axis=1), np.concatenate(masks, axis=1)
+
+    def sample(self, n, rng):
+        # padding is zeros, so don't need to keep the rounds around
+        return sum(values.sum(axis=1) for values, mask in self._sample_rounds(n, rng))
+
 
 class DiceRollKeepHighest(DiceRoll):
     def __init__(self, num, sides, num_highest):
@@ -276,12 +656,26 @@ class DiceRollKeepHighest(DiceRoll):
         return f"{super().__str__()} highest {self.num_highest}"
 
     def eval(self):
-        super().eval()
-        argsort = sorted(
-            range(len(self.results)), key=self.results.__getitem__, reverse=True
-        )
-        self.inds_to_keep = frozenset(argsort[: self.num_highest])
-        return self._set_total()
+        if self.use_counts:
+            counts = self.roll_counts(self.num)
+            kept = keep_counts(counts, self.num_highest, True)
+            return DiceCountsResult(self, counts, kept)
+
+        results = self.roll_dice(self.num)
+        argsort = sorted(range(len(results)), key=results.__getitem__, reverse=True)
+        return DiceRollResult(self, results, frozenset(argsort[: self.num_highest]))
+
+    def sample_dice(self, n, rng):
+        values, _ = super().sample_dice(n, rng)
+        kept = np.zeros_like(values, dtype=bool)
+        inds = np.argsort(values, axis=1)[:, max(self.num - self.num_highest, 0) :]
+        np.put_along_axis(kept, inds, True, axis=1)
+        return values, kept
+
+    def sample(self, n, rng):
+        values, _ = DiceRoll.sample_dice(self, n, rng)
+        values.sort(axis=1)
+        return values[:, max(self.num - self.num_highest, 0) :].sum(axis=1)
 
 
 class DiceRollKeepLowest(DiceRoll):
@@ -293,28 +687,67 @@ class DiceRollKeepLowest(DiceRoll):
         return f"{super().__str__()} lowest {self.num_lowest}"
 
     def eval(self):
-        super().eval()
-        argsort = sorted(range(len(self.results)), key=self.results.__getitem__)
-        self.inds_to_keep = frozenset(argsort[: self.num_lowest])
-        return self._set_total()
+        if self.use_counts:
+            counts = self.roll_counts(self.num)
+            kept = keep_counts(counts, self.num_lowest, False)
+            return DiceCountsResult(self, counts, kept)
+
+        results = self.roll_dice(self.num)
+        argsort = sorted(range(len(results)), key=results.__getitem__)
+        return DiceRollResult(self, results, frozenset(argsort[: self.num_lowest]))
+
+    def sample_dice(self, n, rng):
+        values, _ = super().sample_dice(n, rng)
+        kept = np.zeros_like(values, dtype=bool)
+        inds = np.argsort(values, axis=1)[:, : self.num_lowest]
+        np.put_along_axis(kept, inds, True, axis=1)
+        return values, kept
+
+    def sample(self, n, rng):
+        values, _ = super().sample_dice(n, rng)
+        values.sort(axis=1)
+        return values[:, : self.num_lowest].sum(axis=1)
 
 
 class DiceRollRerollLowest(DiceRollKeepHighest):
     def __init__(self, num, sides, num_reroll):
+        # rerolling more dice than there are rerolls all of them
+        num_reroll = min(num_reroll, num)
         super().__init__(num, sides, num - num_reroll)
         self.num_reroll = num_reroll
 
     def __str__(self):
-        return f"{super().__str__()} reroll {self.num_lowest}"
+        return f"{DiceRoll.__str__(self)} reroll {self.num_reroll}"
 
     def eval(self):
-        super().eval()
-        new = [random.randint(1, self.sides) for _ in range(self.num_reroll)]
-        self.inds_to_keep = self.inds_to_keep | range(
-            len(self.results), len(self.results) + len(new)
+        if self.use_counts:
+            counts = self.roll_counts(self.num)
+            kept = keep_counts(counts, self.num_highest, True)
+            new = self.roll_counts(self.num_reroll)
+            return DiceCountsResult(
+                self, add_counts(counts, new), add_counts(kept, new)
+            )
+
+        kept = super().eval()
+        n = len(kept.results)
+        new = self.roll_dice(self.num_reroll)
+        return DiceRollResult(
+            self,
+            kept.results + new,
+            kept.inds_to_keep | frozenset(range(n, n + len(new))),
+        )
+
+    def sample_dice(self, n, rng):
+        values, kept = super().sample_dice(n, rng)
+        new = rng.integers(1, self.sides, size=(n, self.num_reroll), endpoint=True)
+        return (
+            np.concatenate([values, new], axis=1),
+            np.concatenate([kept, np.ones_like(new, dtype=bool)], axis=1),
         )
-        self.results.extend(new)
-        return self._set_total()
+
+    def sample(self, n, rng):
+        new = rng.integers(1, self.sides, size=(n, self.num_reroll), endpoint=True)
+        return super().sample(n, rng) + new.sum(axis=1)
 
 
 class Comparator(enum.StrEnum):
@@ -337,29 +770,99 @@ class NumHits:
         return f"({self.roll} {self.comp} {self.thresh})"
 
     def eval(self):
-        self.roll.eval()
+        roll_result = self.roll.eval()
         op = getattr(operator, self.comp.name.lower())
-        self.results = [
-            i in self.roll.inds_to_keep and op(r, self.thresh)
-            for i, r in enumerate(self.roll.results)
+        if isinstance(roll_result, DiceCountsResult):
+            hits = [
+                n if op(face, self.thresh) else 0
+                for face, n in enumerate(roll_result.kept, start=1)
+            ]
+            return NumHitsCountsResult(self, roll_result, hits)
+
+        hits = [
+            i in roll_result.inds_to_keep and op(r, self.thresh)
+            for i, r in enumerate(roll_result.results)
         ]
-        self.n_hits = sum(1 if is_hit else 0 for is_hit in self.results)
-        return self.n_hits
+        return NumHitsResult(self, roll_result, hits)
 
-    def result_str(self):
-        if not hasattr(self, "results"):
-            raise ValueError("Roll the dice with eval() first")
+    def sample(self, n, rng):
+        values, kept = self.roll.sample_dice(n, rng)
+        hits = getattr(operator, self.comp.name.lower())(values, self.thresh)
+        if kept is not None:
+            hits &= kept
+        return hits.sum(axis=1)
 
-        parts = []
-        for i, (r, is_hit) in enumerate(zip(self.roll.results, self.results)):
-            if is_hit:
-                parts.append(f"**{self.roll.format_single_roll(i, r)}**")
-            else:
-                parts.append(f"~~{self.roll.format_single_roll(i, r)}~~")
-        all_parts = " ".join(parts)
+    @functools.cached_property
+    def compiled(self):
+        evaluate = self.eval
+
+        def roll():
+            result = evaluate()
+            return result.value, result
+
+        return roll
+
+
+class NumHitsResult:
+    def __init__(self, spec, roll_result, hits):
+        self.spec = spec
+        self.roll_result = roll_result
+        self.results = hits
+        self.value = self.n_hits = sum(1 if is_hit else 0 for is_hit in hits)
+
+    def hit_strs(self):
+        roll = self.roll_result
         return (
-            f"({all_parts} => **{self.n_hits} hit{'' if self.n_hits == 1 else 's'}**)"
+            f"**{roll.format_single_roll(i, r)}**"
+            if is_hit
+            else f"~~{roll.format_single_roll(i, r)}~~"
+            for i, (r, is_hit) in enumerate(zip(roll.results, self.results))
+        )
+
+    def hit_counts(self):
+        "How many hits there were of each face, highest first."
+        roll = self.roll_result
+        counts = collections.Counter(
+            r for r, is_hit in zip(roll.results, self.results) if is_hit
         )
+        return sorted(counts.items(), reverse=True)
+
+    def result_str(self, style=Style.FULL, budget=None):
+        hits = f"**{self.n_hits} hit{'' if self.n_hits == 1 else 's'}**"
+        if style == Style.TOTAL:
+            return fit(f"({hits})", budget)
+
+        room = None if budget is None else budget - len(hits) - 6
+        if style == Style.FULL:
+            all_parts = join_within(" ", self.hit_strs(), room)
+        else:
+            format_die = self.roll_result.roll.format_die
+            parts = (f"{n}×**{format_die(r, True)}**" for r, n in self.hit_counts())
+            if n_misses := self.roll_result.num_dice - self.n_hits:
+                parts = itertools.chain(parts, [f"~~{n_misses} missed~~"])
+            all_parts = join_within(" + ", parts, room)
+        return None if all_parts is None else f"({all_parts} => {hits})"
+
+
+class NumHitsCountsResult(NumHitsResult):
+    "A NumHitsResult for a DiceCountsResult: hits[i] of the dice that rolled i + 1 hit."
+
+    def __init__(self, spec, roll_result, hits):
+        self.spec = spec
+        self.roll_result = roll_result
+        self.results = hits
+        self.value = self.n_hits = sum(hits)
+
+    def hit_strs(self):
+        roll = self.roll_result
+        for hit in [True, False]:
+            for i in range(len(self.results) - 1, -1, -1):
+                n = self.results[i] if hit else roll.counts[i] - self.results[i]
+                die = roll.roll.format_die(i + 1, True)
+                yield from itertools.repeat(f"**{die}**" if hit else f"~~{die}~~", n)
+
+    def hit_counts(self):
+        return [(i + 1, n) for i, n in reversed(list(enumerate(self.results))) if n]
 
 
 class Op(enum.StrEnum):
@@ -371,60 +874,148 @@ class Op(enum.StrEnum):
 class MathOp:
     def __init__(self, op: Op, args):
         self.op = Op(op)
-        self.args = args
-        self.is_random = any(is_random(a) for a in args)
+        self.args = tuple(args)
+        self.is_random = any(is_random(a) for a in args) or self.op == Op.POW
         # ^ should always be True, or would just be a number, but allowing otherwise
+        #   (powers of constants get here when they're too big to work out up front)
 
         if self.op == Op.POW and len(self.args) != 2:
             raise ValueError("Raising to a power needs exactly two arguments")
 
-    def __str__(self, f=str):
-        parts = []
-        for i, a in enumerate(self.args):
+    def __str__(self):
+        return format_math(self, lambda a, budget: str(a))
+
+    def eval(self):
+        arg_results = [get_result(arg) for arg in self.args]
+        evaled_args = [get_value(res) for res in arg_results]
+        if self.op == Op.SUM:
+            value = sum(evaled_args)
+        elif self.op == Op.PROD:
+            value = 1
+            for arg in evaled_args:
+                value *= arg
+        else:
+            assert self.op == Op.POW
+            a, b = evaled_args
+            value = a**b
+        return MathOpResult(self, arg_results, value)
+
+    def sample(self, n, rng):
+        samples = [sample_tree(arg, n, rng) for arg in self.args]
+        if self.op == Op.SUM:
+            return sum(samples)
+
+        # use floats for products, so that huge ones become inf rather than wrapping
+        # around, and so 1/0 is inf rather than an error
+        samples = [np.asarray(s, dtype=float) for s in samples]
+        with np.errstate(divide="ignore", over="ignore", invalid="ignore"):
+            if self.op == Op.PROD:
+                return np.prod(samples, axis=0)
+            else:
+                assert self.op == Op.POW
+                a, b = samples
+                return a**b
+
+    @functools.cached_property
+    def compiled(self):
+        fns = [compile_tree(arg) for arg in self.args]
+
+        if self.op == Op.POW:
+            base_fn, exp_fn = fns
+
+            def roll():
+                base, base_result = base_fn()
+                exp, exp_result = exp_fn()
+                value = base**exp
+                return value, MathOpResult(self, [base_result, exp_result], value)
+
+        elif self.op == Op.SUM:
+
+            def roll():
+                values, results = zip(*[fn() for fn in fns])
+                value = sum(values)
+                return value, MathOpResult(self, results, value)
+
+        else:
+            assert self.op == Op.PROD
+
+            def roll():
+                values, results = zip(*[fn() for fn in fns])
+                value = 1
+                for v in values:
+                    value *= v
+                return value, MathOpResult(self, results, value)
+
+        return roll
+
+
+class MathOpResult:
+    def __init__(self, spec, args, value):
+        self.spec = spec
+        self.op = spec.op
+        self.args = args
+        self.value = value
+
+    def result_str(self, style=Style.FULL, budget=None):
+        return format_math(self, lambda a, b: get_result_str(a, style, b), budget)
+
+
+class _OverBudget(Exception):
+    pass
+
+
+def format_math(node, f, budget=None):
+    """
+    Format a MathOp or a MathOpResult, calling f(arg, budget) on each of its args;
+    returns None if it won't fit in budget, which f should also do.
+    """
+    parts = []
+    length = 0
+
+    def add(part):
+        nonlocal length
+        length += len(part) + 1
+        if budget is not None and length > budget + 1:
+            raise _OverBudget
+        parts.append(part)
+
+    def wrap(a):
+        s = f(a, None if budget is None else budget - length - 2)
+        if s is None:
+            raise _OverBudget
+        return f"({s})" if isinstance(a, (MathOp, MathOpResult)) else s
+
+    try:
+        for i, a in enumerate(node.args):
             if i != 0:
                 # TODO: special case for 1/x
-                if self.op == "+":
+                if node.op == "+":
                     if isinstance(a, numbers.Real) and a < 0:
-                        parts.append("-")
+                        add("-")
                         a *= -1
                     elif (
-                        isinstance(a, MathOp)
+                        isinstance(a, (MathOp, MathOpResult))
                         and a.op == "*"
                         and len(a.args) == 2
                         and isinstance(a.args[0], numbers.Real)
                         and a.args[0] < 0
                     ):
-                        parts.append("-")
+                        add("-")
                         if a.args[0] == -1:
                             a = a.args[1]
                         else:
-                            a = MathOp("*", [-a.args[0], a.args[1]])
+                            add(f"({-a.args[0]} * {wrap(a.args[1])})")
+                            continue
                     else:
-                        parts.append(self.op)
+                        add(node.op)
                 else:
-                    parts.append(self.op)
+                    add(node.op)
 
-            s = f(a)
-            parts.append(f"({s})" if isinstance(a, MathOp) else s)
+            add(wrap(a))
+    except _OverBudget:
+        return None
 
-        return " ".join(parts)
-
-    def result_str(self):
-        return self.__str__(f=get_result_str)
-
-    def eval(self):
-        evaled_args = [get_eval(arg) for arg in self.args]
-        if self.op == Op.SUM:
-            return sum(evaled_args)
-        elif self.op == Op.PROD:
-            prod = 1
-            for arg in evaled_args:
-                prod *= arg
-            return prod
-        else:
-            assert self.op == Op.POW
-            a, b = evaled_args
-            return a**b
+    return " ".join(parts)
 
 
 class CommentedExpr:
@@ -432,6 +1023,7 @@ class CommentedExpr:
         self.roll = roll
         self.pre_comment = pre_comment
         self.post_comment = post_comment
+        self.is_random = is_random(roll)
 
     def __str__(self):
         s = [str(self.roll)]
@@ -442,22 +1034,103 @@ class CommentedExpr:
         return "".join(s)
 
     def eval(self):
-        return get_eval(self.roll)
+        return get_result(self.roll)
+
+    @functools.cached_property
+    def compiled(self):
+        return compile_tree(self.roll)
 
-    def result_str(self):
-        return get_result_str(self.roll)
+    def sample(self, n, rng):
+        return sample_tree(self.roll, n, rng)
 
 
 class Concat:
     def __init__(self, args):
-        self.args = args
+        self.args = tuple(args)
         self.is_random = any(is_random(a) for a in args)
 
     def __str__(self):
         return ",  ".join(str(arg) for arg in self.args)
 
     def eval(self):
-        return [get_eval(arg) for arg in self.args]
+        results = [get_result(arg) for arg in self.args]
+        return ConcatResult(self, results, [get_value(res) for res in results])
+
+    @functools.cached_property
+    def compiled(self):
+        fns = [compile_tree(arg) for arg in self.args]
+
+        def roll():
+            values, results = zip(*[fn() for fn in fns])
+            values = list(values)
+            return values, ConcatResult(self, results, values)
+
+        return roll
+
+
+class ConcatResult:
+    def __init__(self, spec, args, value):
+        self.spec = spec
+        self.args = args
+        self.value = value
+
+    def result_str(self, style=Style.FULL, budget=None):
+        parts = []
+        for arg in self.args:
+            room = None if budget is None else budget - len(",  ".join(parts)) - 3
+            s = get_result_str(arg, style, room)
+            if s is None:
+                return None
+            parts.append(s)
+        return ",  ".join(parts)
+
+
+class Repeat:
+    """
+    roll, rolled times times over, with its own results for each; or if that's more
+    than REPEAT_DETAIL_MAX, only the values, all sampled in one go with numpy.
+    """
+
+    def __init__(self, roll, times, thresh=None):
+        self.roll = roll
+        self.times = times
+        self.thresh = thresh  # count how many come out at least this
+        self.is_random = is_random(roll)
+
+    def __str__(self):
+        s = f"{self.times}x {self.roll}"
+        return s if self.thresh is None else f"{s} vs {self.thresh}"
+
+    @property
+    def detailed(self):
+        return self.times <= REPEAT_DETAIL_MAX
+
+    def eval(self):
+        return self.compiled()[1]
+
+    @functools.cached_property
+    def compiled(self):
+        fn = compile_tree(self.roll)
+
+        def roll():
+            if self.detailed:
+                values, results = zip(*[fn() for _ in range(self.times)])
+                values = list(values)
+            else:
+                from .optimize import optimize  # which imports this module
+
+                values = sample_tree(optimize(self.roll), self.times, get_rng().numpy)
+                results = None
+            return values, RepeatResult(self, results, values)
+
+        return roll
+
+
+class RepeatResult:
+    def __init__(self, spec, results, value):
+        self.spec = spec
+        self.results = results  # None unless spec.detailed
+        self.value = value
 
-    def result_str(self):
-        return ",  ".join(get_result_str(arg) for arg in self.args)
+    def result_str(self, style=Style.FULL, budget=None):
+        return join_within(", ", map(str, self.value), budget)
@@ -0,0 +1,332 @@
+"""
+Exact probability distributions of dice expressions.
+
+Sums of dice are done by convolution (with FFTs for long ones), keep highest/lowest
+with a dynamic program over the faces, hit counts by composing per-die hit
+probabilities, and exploding dice by summing the (truncated) series of explosions.
+Anything that'd take too long or too much memory raises TooExpensiveError, and the
+caller can fall back to sampling instead.
+"""
+import math
+import operator
+import threading
+
+import numpy as np
+
+from . import dice, optimize
+from ..utils import LRUCache
+
+# the most distinct values we'll track in any one distribution
+MAX_SUPPORT = 50_000
+# rough limit on the number of array-element operations for one distribution
+MAX_WORK = 100_000_000
+# and on how many times to go round a loop in Python, which costs far more per step
+MAX_LOOPS = 50_000
+# once the chance of another explosion is below this, stop adding them up
+EXPLOSION_TOL = 1e-16
+# use FFTs to convolve when both sides are at least this long
+FFT_MIN_SIZE = 64
+
+
+class TooExpensiveError(ValueError):
+    pass
+
+
+class Distribution:
+    "A finite distribution: sorted distinct values, with their probabilities."
+
+    def __init__(self, values, probs):
+        self.values = np.asarray(values)
+        self.probs = np.asarray(probs, dtype=float)
+
+    @classmethod
+    def point(cls, value):
+        if isinstance(value, int) and abs(value) >= 2**53:
+            # too big for int64 (maybe), which numpy would make an object array of
+            try:
+                value = float(value)
+            except OverflowError:
+                value = math.copysign(math.inf, value)
+        return cls([value], [1.0])
+
+    @classmethod
+    def dense(cls, probs, offset=0):
+        "From an array where probs[i] is the chance of offset + i."
+        (nonzero,) = np.nonzero(probs > 0)
+        return cls(offset + nonzero, probs[nonzero])
+
+    @classmethod
+    def from_pairs(cls, values, probs):
+        "From arbitrary values and probabilities, possibly repeated."
+        values, inverse = np.unique(values, return_inverse=True)
+        probs = np.bincount(inverse.ravel(), weights=np.ravel(probs))
+        return cls(_maybe_int(values), probs)
+
+    def __len__(self):
+        return len(self.values)
+
+    @property
+    def is_integer(self):
+        return np.issubdtype(self.values.dtype, np.integer)
+
+    def to_dense(self):
+        "Returns (probs, offset), as for dense()."
+        offset = int(self.values[0])
+        size = int(self.values[-1]) - offset + 1
+        check_support(size)
+        probs = np.zeros(size)
+        probs[self.values - offset] = self.probs
+        return probs, offset
+
+
+def check_support(size):
+    if size > MAX_SUPPORT:
+        raise TooExpensiveError(f"would need to track {size:,} different values")
+
+
+def check_work(work, loops=0):
+    if work > MAX_WORK or loops > MAX_LOOPS:
+        raise TooExpensiveError(f"would take about {max(work, loops):,.0f} steps")
+
+
+def _maybe_int(values):
+    "Turn float values back into ints if they all are, and aren't too big."
+    if (
+        values.dtype.kind == "f"
+        and np.isfinite(values).all()
+        and (np.abs(values) < 2**53).all()
+        and (values == np.round(values)).all()
+    ):
+        return values.astype(np.int64)
+    return values
+
+
+################################################################################
+# Operations on dense arrays: a[i] is the chance of getting i
+# (these might be sub-probabilities, not adding up to one)
+
+
+def convolve(a, b):
+    if min(len(a), len(b)) < FFT_MIN_SIZE:
+        return np.convolve(a, b)
+
+    size = len(a) + len(b) - 1
+    out = np.fft.irfft(np.fft.rfft(a, size) * np.fft.rfft(b, size), size)
+    # get rid of rounding noise
+    out[out < 1e-15 * out.max()] = 0
+    return out
+
+
+def convolve_power(a, n):
+    "Distribution of the sum of n independent copies of a."
+    check_support((len(a) - 1) * n + 1)
+    result = np.ones(1)
+    while n:
+        if n & 1:
+            result = convolve(result, a)
+        n >>= 1
+        if n:
+            a = convolve(a, a)
+    return result
+
+
+def add_dense(a, b):
+    out = np.zeros(max(len(a), len(b)))
+    out[: len(a)] += a
+    out[: len(b)] += b
+    return out
+
+
+def die_scores(roll, score):
+    "Chances of each score for one die of roll, where a face v scores score(v)."
+    p = 1 / roll.sides
+    scores = [score(v) for v in range(1, roll.sides + 1)]
+    out = np.zeros(max(scores) + 1)
+    for s in scores:
+        out[s] += p
+    return out
+
+
+def keep_scores(num, sides, k, highest, score):
+    """
+    Distribution of the total score of the k highest (or lowest) of num dice.
+
+    Goes through the faces from the best to the worst, keeping track of how many
+    dice have been given a face so far, how many of those are kept, and the total
+    kept score; each step decides how many of the remaining dice get this face.
+    """
+    k = max(min(k, num), 0)
+    if k == 0:
+        return np.ones(1)
+    scores = [0] + [score(v) for v in range(1, sides + 1)]
+    max_total = k * max(scores)
+    check_support(max_total + 1)
+    loops = sides * (num + 1) ** 2 // 2 * (k + 1)
+    check_work(loops * (max_total + 1), loops)
+
+    # log_choose[rem, c]: the log of (rem choose c), for c <= rem
+    log_fact = np.concatenate([[0.0], np.cumsum(np.log(np.arange(1, num + 1)))])
+    rems = np.arange(num + 1)[:, np.newaxis]
+    cs = np.arange(num + 1)[np.newaxis]
+    rest = np.maximum(rems - cs, 0)
+    log_choose = log_fact[rems] - log_fact[cs] - log_fact[rest]
+
+    # state[n, j, s]: n dice assigned, j kept, total kept score s
+    state = np.zeros((num + 1, k + 1, max_total + 1))
+    state[0, 0, 0] = 1
+    faces = range(sides, 0, -1) if highest else range(1, sides + 1)
+    try:
+        with np.errstate(over="raise"):
+            for faces_left, v in zip(range(sides, 0, -1), faces):
+                # ways[rem, c]: chance that c of the rem dice without a face yet get
+                # this one, each having 1 / faces_left chance; none of these is
+                # more than 1, so nothing can overflow
+                if faces_left == 1:
+                    ways = (cs == rems).astype(float)
+                else:
+                    q = 1 / faces_left
+                    log_ways = log_choose + cs * math.log(q) + rest * math.log1p(-q)
+                    ways = np.where(cs <= rems, np.exp(log_ways), 0)
+
+                new = np.zeros_like(state)
+                for n in range(num + 1):
+                    if not state[n].any():
+                        continue
+                    left = num - n
+                    for c in range(left + 1):
+                        w = ways[left, c]
+                        if w == 0:
+                            continue
+                        for j in range(k + 1):
+                            add = min(c, k - j)
+                            shift = add * scores[v]
+                            end = max_total + 1 - shift
+                            new[n + c, j + add, shift:] += w * state[n, j, :end]
+                state = new
+    except FloatingPointError:
+        raise TooExpensiveError("the numbers got too big to work with") from None
+
+    return state[num].sum(axis=0)
+
+
+def explosion_scores(roll, score):
+    """
+    Chances of each total score for one die of an exploding roll, including all the
+    dice it sets off. Each round is independent, so that's
+      sum_{d < cap} explode^d * stop + explode^cap * any
+    where explode/stop are the chances for faces that do/don't explode.
+    """
+    p = 1 / roll.sides
+    scores = [score(v) for v in range(1, roll.sides + 1)]
+    explode = np.zeros(max(scores) + 1)
+    stop = np.zeros(max(scores) + 1)
+    for v, s in enumerate(scores, start=1):
+        (explode if v >= roll.explode_thresh else stop)[s] += p
+
+    q = explode.sum()
+    depth = roll.explosions_cap
+    if 0 < q < 1:
+        depth = min(depth, math.ceil(math.log(EXPLOSION_TOL) / math.log(q)))
+    check_support((depth + 1) * (len(explode) - 1) + 1)
+
+    out = np.zeros(1)
+    chain = np.ones(1)  # chance of getting here with each score so far
+    for _ in range(depth):
+        if not chain.any():
+            break
+        out = add_dense(out, convolve(chain, stop))
+        chain = convolve(chain, explode)
+    else:
+        # hit the cap (or close enough to zero): last one doesn't explode
+        out = add_dense(out, convolve(chain, explode + stop))
+    return out
+
+
+def roll_scores(roll, score):
+    "Distribution of the total score of the kept dice in roll, as a dense array."
+    if isinstance(roll, dice.ExplodingDiceRoll):
+        return convolve_power(explosion_scores(roll, score), roll.num)
+    elif isinstance(roll, dice.DiceRollRerollLowest):
+        return convolve(
+            keep_scores(roll.num, roll.sides, roll.num_highest, True, score),
+            convolve_power(die_scores(roll, score), roll.num_reroll),
+        )
+    elif isinstance(roll, dice.DiceRollKeepHighest):
+        return keep_scores(roll.num, roll.sides, roll.num_highest, True, score)
+    elif isinstance(roll, dice.DiceRollKeepLowest):
+        return keep_scores(roll.num, roll.sides, roll.num_lowest, False, score)
+    else:
+        assert type(roll) is dice.DiceRoll
+        return convolve_power(die_scores(roll, score), roll.num)
+
+
+################################################################################
+# Distributions of whole trees
+
+
+def combine(op, a, b):
+    "Distribution of op(x, y) for independent x ~ a, y ~ b."
+    if op is operator.add and a.is_integer and b.is_integer:
+        a_probs, a_offset = a.to_dense()
+        b_probs, b_offset = b.to_dense()
+        return Distribution.dense(convolve(a_probs, b_probs), a_offset + b_offset)
+
+    check_support(len(a) * len(b))
+    with np.errstate(divide="ignore", over="ignore", invalid="ignore"):
+        values = op(
+            a.values.astype(float)[:, np.newaxis], b.values.astype(float)[np.newaxis]
+        )
+    return Distribution.from_pairs(values, np.outer(a.probs, b.probs))
+
+
+OPS = {dice.Op.SUM: operator.add, dice.Op.PROD: operator.mul, dice.Op.POW: operator.pow}
+
+
+_cache = LRUCache(64)
+_cache_lock = threading.Lock()
+
+
+def distribution(obj):
+    "The exact Distribution of obj's value, working it out from optimize(obj)."
+    return tree_distribution(optimize.optimize(obj))
+
+
+def tree_distribution(obj):
+    """
+    The exact Distribution of obj's value, from obj as it is. Results are cached by
+    the canonical form of the (sub-)expression, i.e. str(obj).
+    """
+    if isinstance(obj, dice.CommentedExpr):
+        return tree_distribution(obj.roll)
+    if not dice.is_random(obj):
+        return Distribution.point(obj)
+
+    key = str(obj)
+    with _cache_lock:
+        dist = _cache.get(key)
+    if dist is None:
+        dist = _distribution(obj)
+        with _cache_lock:
+            _cache[key] = dist
+    return dist
+
+
+def _distribution(obj):
+    if isinstance(obj, dice.DiceRoll):
+        return Distribution.dense(roll_scores(obj, lambda v: v))
+
+    elif isinstance(obj, dice.NumHits):
+        op = getattr(operator, obj.comp.name.lower())
+        return Distribution.dense(
+            roll_scores(obj.roll, lambda v: 1 if op(v, obj.thresh) else 0)
+        )
+
+    elif isinstance(obj, dice.MathOp):
+        op = OPS[obj.op]
+        dist, *rest = [tree_distribution(arg) for arg in obj.args]
+        for other in rest:
+            dist = combine(op, dist, other)
+        return dist
+
+    else:
+        raise TypeError(f"Don't know how to get the distribution of {obj!r}")
@@ -0,0 +1,281 @@
+"""
+Recent ~roll results, per user and per channel, for ~rollstats.
+
+Each RollHistory is a pair of fixed-size numpy ring buffers: one of rolls (which
+expression, as an id into a shared SpecTable, and the total), and one of the faces
+of the dice rolled for them (with how many sides each had). The number of histories
+is bounded too, dropping the least recently used, so the whole thing has a fixed
+upper bound on memory.
+
+The statistics compare each total with the exact distribution of its expression: a
+roll's percentile rank is the chance of rolling lower, plus half the chance of
+rolling the same. Over plenty of fair rolls, those ranks average to 50%.
+"""
+import math
+
+import numpy as np
+
+from . import dice, tables
+from ..utils import LRUCache
+
+# how many rolls, and how many dice in them, each history keeps
+MAX_ROLLS = 500
+MAX_FACES = 5000
+# dice from a roll with more than this many aren't kept (but its total still is)
+MAX_FACES_PER_ROLL = 1000
+# how many users and channels to keep histories for
+MAX_USERS = 256
+MAX_CHANNELS = 64
+# how many distinct expressions to tell apart; any more aren't compared against
+# their distributions
+MAX_SPECS = 4096
+
+NO_FACES = np.zeros(0, dtype=np.int32)
+
+
+class SpecTable:
+    "Gives each distinct expression, by its canonical string, a small integer id."
+
+    def __init__(self, max_specs=MAX_SPECS):
+        self.max_specs = max_specs
+        self.ids = {}
+        self.specs = []
+
+    def get_id(self, spec):
+        "spec's id, or -1 if it's new and there's no room for it."
+        spec_id = self.ids.get(spec)
+        if spec_id is None:
+            if len(self.specs) >= self.max_specs:
+                return -1
+            spec_id = self.ids[spec] = len(self.specs)
+            self.specs.append(spec)
+        return spec_id
+
+
+class RollHistory:
+    def __init__(self, max_rolls=MAX_ROLLS, max_faces=MAX_FACES):
+        self.spec_ids = np.full(max_rolls, -1, dtype=np.int32)
+        self.totals = np.zeros(max_rolls, dtype=np.float64)
+        self.faces = np.zeros(max_faces, dtype=np.int32)
+        self.sides = np.zeros(max_faces, dtype=np.int32)
+        self.n_rolls = 0  # ever recorded; the last len(self.totals) are still here
+        self.n_faces = 0
+
+    @property
+    def nbytes(self):
+        return (
+            self.spec_ids.nbytes
+            + self.totals.nbytes
+            + self.faces.nbytes
+            + self.sides.nbytes
+        )
+
+    @staticmethod
+    def _write(buffers, n, values):
+        "Write each of values into the matching ring buffer, from position n on."
+        size = len(buffers[0])
+        k = len(values[0])
+        skip = max(k - size, 0)
+        positions = (n + np.arange(skip, k)) % size
+        for buffer, vals in zip(buffers, values):
+            buffer[positions] = vals[skip:]
+
+    def add(self, spec_id, totals, faces=NO_FACES, sides=NO_FACES):
+        "Record rolls of spec_id which came out as totals, with the dice faces/sides."
+        self._write(
+            [self.spec_ids, self.totals],
+            self.n_rolls,
+            [np.full(len(totals), spec_id, dtype=np.int32), totals],
+        )
+        self.n_rolls += len(totals)
+        self._write([self.faces, self.sides], self.n_faces, [faces, sides])
+        self.n_faces += len(faces)
+
+    def copy(self):
+        "A snapshot of this history, to look at in another thread."
+        new = RollHistory.__new__(RollHistory)
+        new.spec_ids = self.spec_ids.copy()
+        new.totals = self.totals.copy()
+        new.faces = self.faces.copy()
+        new.sides = self.sides.copy()
+        new.n_rolls = self.n_rolls
+        new.n_faces = self.n_faces
+        return new
+
+    def rolls(self):
+        "(spec_ids, totals) of the rolls still in the buffer, in no particular order."
+        n = min(self.n_rolls, len(self.totals))
+        return self.spec_ids[:n], self.totals[:n]
+
+    def dice(self):
+        "(faces, sides) of the dice still in the buffer, in no particular order."
+        n = min(self.n_faces, len(self.faces))
+        return self.faces[:n], self.sides[:n]
+
+
+class HistoryStore:
+    "The RollHistory of each user and each channel, up to a limit on each."
+
+    def __init__(
+        self,
+        max_users=MAX_USERS,
+        max_channels=MAX_CHANNELS,
+        max_rolls=MAX_ROLLS,
+        max_faces=MAX_FACES,
+    ):
+        self.specs = SpecTable()
+        self.users = LRUCache(max_users)
+        self.channels = LRUCache(max_channels)
+        self.max_rolls = max_rolls
+        self.max_faces = max_faces
+
+    def get(self, histories, key):
+        history = histories.get(key)
+        if history is None:
+            histories[key] = history = RollHistory(self.max_rolls, self.max_faces)
+        return history
+
+    def record(self, user_id, channel_id, entries):
+        "Record entries, as from extract(), for both the user and the channel."
+        user = self.get(self.users, user_id)
+        channel = self.get(self.channels, channel_id)
+        for spec, totals, faces, sides in entries:
+            spec_id = self.specs.get_id(spec)
+            for history in [user, channel]:
+                history.add(spec_id, totals, faces, sides)
+
+    def history_bytes(self):
+        return RollHistory(self.max_rolls, self.max_faces).nbytes
+
+    @property
+    def nbytes(self):
+        return self.history_bytes() * (len(self.users) + len(self.channels))
+
+    @property
+    def max_nbytes(self):
+        n_histories = self.users.max_size + self.channels.max_size
+        return self.history_bytes() * n_histories
+
+
+def roll_faces(result):
+    "Yields (faces, sides) arrays for each pool of dice in result."
+    if isinstance(result, dice.DiceCountsResult):
+        if result.num_dice <= MAX_FACES_PER_ROLL:
+            faces = np.repeat(
+                np.arange(1, len(result.counts) + 1, dtype=np.int32), result.counts
+            )
+            # these come out sorted, and the oldest of them can get overwritten
+            # before the rest; shuffled, that doesn't favour the high ones. (This
+            # isn't a dice roll, so it doesn't use up the dice's random stream.)
+            np.random.default_rng().shuffle(faces)
+            yield faces, np.full(len(faces), result.roll.sides, dtype=np.int32)
+    elif isinstance(result, dice.DiceRollResult):
+        if result.num_dice <= MAX_FACES_PER_ROLL:
+            faces = np.array(result.results, dtype=np.int32)
+            yield faces, np.full(len(faces), result.roll.sides, dtype=np.int32)
+    elif isinstance(result, dice.NumHitsResult):
+        yield from roll_faces(result.roll_result)
+    elif isinstance(result, dice.MathOpResult):
+        for arg in result.args:
+            yield from roll_faces(arg)
+
+
+def to_float(x):
+    try:
+        return float(x)
+    except OverflowError:
+        return math.copysign(math.inf, x)
+
+
+def entry(roll, result):
+    pools = list(roll_faces(result))
+    if pools:
+        faces, sides = map(np.concatenate, zip(*pools))
+    else:
+        faces = sides = NO_FACES
+    totals = np.array([to_float(dice.get_value(result))])
+    return str(roll), totals, faces, sides
+
+
+def extract(roll, result):
+    """
+    What to record about rolling roll with this result: a list of entries (spec,
+    totals, faces, sides), with spec the canonical string of what was rolled. They're
+    small and pickle cheaply, so workers can send them back.
+    """
+    if isinstance(roll, dice.CommentedExpr):
+        return extract(roll.roll, result)
+    elif isinstance(roll, dice.Concat):
+        return [e for r, res in zip(roll.args, result.args) for e in extract(r, res)]
+    elif isinstance(roll, dice.Repeat):
+        inner = roll.roll
+        if isinstance(inner, dice.CommentedExpr):
+            inner = inner.roll
+        if result.results is None:
+            # only as many as a history can hold; there could be millions
+            totals = np.asarray(result.value[-MAX_ROLLS:], dtype=float)
+            return [(str(inner), totals, NO_FACES, NO_FACES)]
+        return [entry(inner, res) for res in result.results]
+    elif not dice.is_random(roll):
+        return []
+    return [entry(roll, result)]
+
+
+def percentile_ranks(specs, spec_ids, totals):
+    """
+    The percentile rank (from 0 to 1) of each total within the distribution of its
+    spec, as an array; NaN where that isn't known.
+    """
+    ranks = np.full(len(totals), np.nan)
+    for spec_id in np.unique(spec_ids):
+        if spec_id < 0:
+            continue
+        table = tables.get_table(specs.specs[spec_id])
+        if table is None:
+            continue
+        mask = spec_ids == spec_id
+        x = totals[mask]
+        at_least, at_most = table.chances(x)
+        ranks[mask] = (1 - at_least + at_most) / 2
+    ranks[~np.isfinite(totals)] = np.nan
+    return ranks
+
+
+def summarize(specs, history):
+    "Describe how lucky the rolls in history have been, as a list of lines."
+    spec_ids, totals = history.rolls()
+    if not len(totals):
+        return ["No rolls yet."]
+
+    n_kept = len(totals)
+    n_specs = len(np.unique(spec_ids))
+    lines = [
+        f"The last {n_kept:,} rolls"
+        + (f" (of {history.n_rolls:,})" if history.n_rolls > n_kept else "")
+        + f", of {n_specs:,} different thing{'' if n_specs == 1 else 's'}:"
+    ]
+
+    ranks = percentile_ranks(specs, spec_ids, totals)
+    ranks = ranks[np.isfinite(ranks)]
+    if len(ranks):
+        q25, q50, q75 = np.percentile(ranks, [25, 50, 75])
+        # the mean rank of n fair rolls has a standard deviation of at most this
+        sd = 1 / np.sqrt(12 * len(ranks))
+        lines.append(
+            f"totals: on average at the **{ranks.mean():.0%}** percentile "
+            f"(expected 50% ± {2 * sd:.0%}); quartiles {q25:.0%} / {q50:.0%} / "
+            f"{q75:.0%} (expected 25% / 50% / 75%), over {len(ranks):,} rolls"
+        )
+    else:
+        lines.append("totals: can't work out the chances for any of these, sorry")
+
+    faces, sides = history.dice()
+    if len(faces):
+        height = (faces - 0.5) / sides
+        lines.append(
+            f"dice: {len(faces):,} rolled, on average **{height.mean():.0%}** of the "
+            f"way up (expected 50%); **{np.mean(faces == sides):.1%}** max faces "
+            f"(expected {np.mean(1 / sides):.1%}), **{np.mean(faces == 1):.1%}** "
+            f"ones (expected {np.mean(1 / sides):.1%})"
+        )
+    return lines
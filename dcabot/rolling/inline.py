@@ -0,0 +1,24 @@
+"""
+Finding inline rolls in ordinary messages: "I swing [[d20+5]] at it".
+
+Every message the bot can see goes through here, so the first check is just a
+substring search for "[[", which turns down almost all chat in well under a
+microsecond; only messages with that in go on to the regex, and only what's
+between the brackets ever gets to the parser. (benchmarks.bench_inline times it.)
+"""
+import itertools
+import re
+
+OPEN = "[["
+# how many rolls to do from one message, and how long each can be
+MAX_SPANS = 5
+MAX_SPAN_LEN = 200
+SPAN = re.compile(r"\[\[([^\[\]\n]{1,%d})\]\]" % MAX_SPAN_LEN)
+
+
+def find_specs(content):
+    "The specs of the inline rolls in content, at most MAX_SPANS of them."
+    if OPEN not in content:
+        return []
+    specs = (m.group(1).strip() for m in SPAN.finditer(content))
+    return list(itertools.islice(filter(None, specs), MAX_SPANS))
@@ -0,0 +1,143 @@
+"""
+Saved dice expressions ("macros"), so people can ~roll !attack instead of typing it.
+
+Each belongs either to a user or to a guild. They're stored in a SQLite file, and
+all loaded at once when the cog starts; each is parsed (and compiled) when it's
+saved or loaded, so rolling one doesn't go near the parser. There's a limit on how
+many each user or guild can have, and how long they can be, to bound the memory.
+"""
+import re
+import sqlite3
+import threading
+
+from . import dice
+
+MAX_MACROS = 50  # per user, or per guild
+MAX_SPEC_LEN = 500
+NAME_PATTERN = re.compile(r"[\w-]{1,32}")
+
+USER = "user"
+GUILD = "guild"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS macros (
+    scope TEXT NOT NULL,
+    owner INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    spec TEXT NOT NULL,
+    PRIMARY KEY (scope, owner, name)
+)
+"""
+
+
+class MacroError(ValueError):
+    pass
+
+
+class Macro:
+    def __init__(self, name, spec, tree):
+        self.name = name
+        self.spec = spec
+        self.tree = tree
+
+
+def compile_macro(name, spec):
+    """
+    A Macro for spec; raises lark.UnexpectedInput if it doesn't parse. This runs in
+    worker threads, so it parses afresh rather than going through the tree cache.
+    """
+    tree = dice.parse_dice_tree(spec)
+    dice.compile_tree(tree)  # build the compiled version now, rather than on use
+    return Macro(name, spec, tree)
+
+
+def normalize_name(name):
+    name = name.removeprefix("!").lower()
+    if not NAME_PATTERN.fullmatch(name):
+        raise MacroError(
+            "Macro names can only have letters, numbers, - and _, up to 32 of them."
+        )
+    return name
+
+
+class MacroStore:
+    """
+    The macros of every user and guild: in memory, keyed by (scope, owner id), and
+    written through to the SQLite file at path. The writes can happen in any thread.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.macros = {}
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute(SCHEMA)
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def load(self):
+        """
+        Load all the macros from the file, replacing any in memory; returns how many
+        there are, leaving out any that no longer parse.
+        """
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT scope, owner, name, spec FROM macros"
+            ).fetchall()
+        macros = {}
+        n_loaded = 0
+        for scope, owner, name, spec in rows:
+            try:
+                macro = compile_macro(name, spec)
+            except Exception:
+                # the grammar might've changed since; leave it be, but don't offer it
+                continue
+            macros.setdefault((scope, owner), {})[name] = macro
+            n_loaded += 1
+        self.macros = macros
+        return n_loaded
+
+    def get(self, scope, owner, name):
+        return self.macros.get((scope, owner), {}).get(name)
+
+    def owned(self, scope, owner):
+        "The macros of that user or guild, by name."
+        return self.macros.get((scope, owner), {})
+
+    def save(self, scope, owner, name, spec):
+        """
+        Save spec as macro name; returns the Macro, or raises MacroError (or
+        lark.UnexpectedInput, if spec doesn't parse).
+        """
+        name = normalize_name(name)
+        if len(spec) > MAX_SPEC_LEN:
+            raise MacroError(f"Macros can be at most {MAX_SPEC_LEN} characters long.")
+        owned = self.owned(scope, owner)
+        if name not in owned and len(owned) >= MAX_MACROS:
+            raise MacroError(
+                f"That's the limit of {MAX_MACROS} macros; delete some first?"
+            )
+
+        macro = compile_macro(name, spec)
+        with self.lock:
+            with self.db:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO macros VALUES (?, ?, ?, ?)",
+                    (scope, owner, name, spec),
+                )
+        self.macros.setdefault((scope, owner), {})[name] = macro
+        return macro
+
+    def delete(self, scope, owner, name):
+        "Delete macro name; returns whether there was one."
+        name = normalize_name(name)
+        with self.lock:
+            with self.db:
+                deleted = self.db.execute(
+                    "DELETE FROM macros WHERE scope = ? AND owner = ? AND name = ?",
+                    (scope, owner, name),
+                ).rowcount
+        self.owned(scope, owner).pop(name, None)
+        return bool(deleted)
@@ -0,0 +1,139 @@
+"""
+Simplifying dice trees, for when only their values matter.
+
+The parser keeps trees the shape they were written in, because that's how they're
+displayed: "(d6 + 1) + 2" shows the d6 and the 1 and the 2. But for sampling values
+with numpy, or working out exact distributions, that shape is just overhead: nested
+sums and products, constants split across levels, -1 * ... for every minus sign,
+and ^-1 for every division. optimize() gives an equivalent tree without those:
+
+- nested sums are flattened into one sum, and nested products into one product
+- constants are folded together across all those levels (and into x^-1 for
+  constant x), dropping + 0 and * 1 entirely
+- plain dice with the same number of sides are pooled, so d6 + d6 + 2d6 is 4d6
+- (x^-1)^-1 is x, and x^1 is x
+
+The result is only for values: display, and anything else that needs the results
+of the individual parts, should use the original tree. The original isn't changed.
+"""
+import threading
+
+from . import dice
+from ..utils import LRUCache
+
+_cache = LRUCache(1024)
+_cache_lock = threading.Lock()
+
+
+def optimize(obj):
+    """
+    An equivalent tree to obj, for values only; cached by str(obj), and its type,
+    since a Concat of one thing looks just like the thing.
+    """
+    if not dice.is_random(obj):
+        return obj
+    key = (type(obj), str(obj))
+    with _cache_lock:
+        opt = _cache.get(key)
+    if opt is None:
+        opt = _optimize(obj)
+        with _cache_lock:
+            _cache[key] = opt
+    return opt
+
+
+def _optimize(obj):
+    if isinstance(obj, dice.CommentedExpr):
+        return _optimize(obj.roll)
+
+    elif isinstance(obj, dice.Concat):
+        return dice.Concat([_optimize(arg) for arg in obj.args])
+
+    elif isinstance(obj, dice.Repeat):
+        return dice.Repeat(_optimize(obj.roll), obj.times, obj.thresh)
+
+    elif isinstance(obj, dice.MathOp):
+        args = [_optimize(arg) for arg in obj.args]
+        if obj.op == dice.Op.SUM:
+            return optimize_sum(args)
+        elif obj.op == dice.Op.PROD:
+            return optimize_prod(args)
+        else:
+            assert obj.op == dice.Op.POW
+            return optimize_pow(*args)
+
+    else:
+        # dice, and hits on them: nothing to simplify
+        return obj
+
+
+def flatten(args, op):
+    "args, with any of them that are MathOps of op replaced by their own args."
+    for arg in args:
+        if isinstance(arg, dice.MathOp) and arg.op == op:
+            yield from arg.args
+        else:
+            yield arg
+
+
+def make_op(op, random_parts, constant, identity):
+    "random_parts combined with op, along with constant unless it's identity."
+    if not random_parts:
+        return constant
+    if constant != identity:
+        random_parts.append(constant)
+    if len(random_parts) == 1:
+        return random_parts[0]
+    return dice.MathOp(op, random_parts)
+
+
+def optimize_sum(args):
+    constant = 0
+    pooled = {}  # sides -> number of dice, for plain dice
+    random_parts = []
+    for arg in flatten(args, dice.Op.SUM):
+        if not dice.is_random(arg):
+            constant += arg
+        elif type(arg) is dice.DiceRoll:
+            if arg.sides not in pooled:
+                # keep it in the same place among the parts
+                pooled[arg.sides] = 0
+                random_parts.append(arg.sides)
+            pooled[arg.sides] += arg.num
+        else:
+            random_parts.append(arg)
+
+    random_parts = [
+        dice.DiceRoll(pooled[part], part) if isinstance(part, int) else part
+        for part in random_parts
+    ]
+    return make_op(dice.Op.SUM, random_parts, constant, 0)
+
+
+def optimize_prod(args):
+    constant = 1
+    random_parts = []
+    for arg in flatten(args, dice.Op.PROD):
+        if not dice.is_random(arg):
+            constant *= arg
+        else:
+            random_parts.append(arg)
+    return make_op(dice.Op.PROD, random_parts, constant, 1)
+
+
+def optimize_pow(base, exp):
+    if not dice.is_random(base) and not dice.is_random(exp):
+        if dice.is_huge_pow(base, exp):
+            # leave it to be turned down, just like the parser does
+            return dice.MathOp(dice.Op.POW, [base, exp])
+        return base**exp
+    if exp == 1:
+        return base
+    if (
+        exp == -1
+        and isinstance(base, dice.MathOp)
+        and base.op == dice.Op.POW
+        and base.args[1] == -1
+    ):
+        return base.args[0]
+    return dice.MathOp(dice.Op.POW, [base, exp])
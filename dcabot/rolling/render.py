@@ -0,0 +1,208 @@
+"""
+Turning rolls into the text of replies. Nothing in here touches discord, so it can
+run anywhere, including in the worker processes.
+"""
+import math
+
+import numpy as np
+
+from . import dice, history, tables
+
+MAX_MESSAGE_LEN = 2000
+# send anything that'd take more messages than this as a file instead
+MAX_MESSAGES = 3
+# and within that file, don't let any one line go past this
+MAX_FILE_LINE_LEN = 100_000
+# each roll in the table for a repeat gets a line this long at most
+REPEAT_LINE_LEN = 120
+
+
+def pack_messages(lines, limit=MAX_MESSAGE_LEN):
+    "Join lines into as few messages as possible, cutting short any that are too long."
+    messages = []
+    current = None
+    for line in lines:
+        if len(line) > limit:
+            line = line[: limit - 1] + "…"
+        if current is not None and len(current) + 1 + len(line) <= limit:
+            current = f"{current}\n{line}"
+        else:
+            if current is not None:
+                messages.append(current)
+            current = line
+    if current is not None:
+        messages.append(current)
+    return messages
+
+
+def needs_file(lines):
+    return len(pack_messages(lines)) > MAX_MESSAGES
+
+
+def format_result(roll, result, budget=MAX_MESSAGE_LEN, ranks=True):
+    """
+    One line describing how roll came out. If the full detail won't fit in budget,
+    summarizes the dice instead, or leaves them out entirely. With ranks, says where
+    the value comes among the roll's results, if that's to hand.
+    """
+    if isinstance(roll, dice.CommentedExpr):
+        pre_comment = roll.pre_comment
+        post_comment = roll.post_comment
+        roll = roll.roll
+    else:
+        pre_comment = None
+        post_comment = None
+
+    value = dice.get_value(result)
+
+    # TODO: prettier
+    spec = str(roll)
+    start = f"{spec}    ::    "
+    end = f"    ↠    **{value}**"
+    if ranks and (where := describe_rank(roll, spec, value)) is not None:
+        end = f"{end} ({where})"
+    if pre_comment:
+        start = f"{pre_comment}:   {start}"
+    if post_comment:
+        end = f"{end}   # {post_comment}"
+
+    result_str = dice.render_result(result, budget - len(start) - len(end))
+    if result_str is None:
+        return start.removesuffix("    ::    ") + end
+    return start + result_str + end
+
+
+def format_chance(p):
+    pct = 100 * p
+    if pct < 0.01:
+        return "<0.01%"
+    return f"{pct:.0f}%" if pct >= 1 else f"{pct:.2g}%"
+
+
+def describe_rank(roll, spec, value):
+    """
+    Where value comes among the results of roll (whose str() is spec), like "top 8%";
+    None if it's not random, or its distribution isn't to hand (this only looks it up).
+    """
+    if not dice.is_random(roll):
+        return None
+    try:
+        value = float(value)
+    except OverflowError:
+        return None
+    table = tables.lookup(spec)
+    if table is None or len(table.values) < 2 or not math.isfinite(value):
+        return None
+    at_least, at_most = table.chances(value)
+    if at_least <= at_most:
+        return f"top {format_chance(at_least)}"
+    return f"bottom {format_chance(at_most)}"
+
+
+def roll_and_format(roll, ranks=True):
+    """
+    Roll roll, returning the lines to reply with, a function giving more detailed ones
+    for a file, and the entries to record in the roll history. Without ranks, the
+    lines don't depend on which distributions happen to have been worked out yet.
+    """
+    _, result = dice.compile_tree(roll)()
+    entries = history.extract(roll, result)
+    if isinstance(roll, dice.Repeat):
+        lines = format_repeat(roll, result)
+        return lines, lambda: lines, entries
+    if isinstance(roll, dice.Concat):
+        pairs = list(zip(roll.args, result.args))
+    else:
+        pairs = [(roll, result)]
+
+    return (
+        [format_result(r, res, ranks=ranks) for r, res in pairs],
+        lambda: [
+            format_result(r, res, MAX_FILE_LINE_LEN, ranks=ranks) for r, res in pairs
+        ],
+        entries,
+    )
+
+
+def format_value(x):
+    if isinstance(x, int):
+        return f"{x:,}"
+    return f"{x:,.0f}" if float(x).is_integer() else f"{x:,.2f}"
+
+
+def format_repeat(roll, result):
+    """
+    The lines describing how a Repeat came out: what was rolled, a table of each roll
+    (if there weren't too many to show), and a summary.
+    """
+    inner = roll.roll
+    pre_comment = post_comment = None
+    if isinstance(inner, dice.CommentedExpr):
+        pre_comment = inner.pre_comment
+        post_comment = inner.post_comment
+        inner = inner.roll
+
+    header = f"{roll.times:,}x {inner}"
+    if roll.thresh is not None:
+        header = f"{header} vs {roll.thresh}"
+    if pre_comment:
+        header = f"{pre_comment}:   {header}"
+    if post_comment:
+        header = f"{header}   # {post_comment}"
+    lines = [header]
+
+    if result.results is not None:
+        width = len(str(roll.times))
+        for i, (res, value) in enumerate(zip(result.results, result.value), 1):
+            start = f"`{i:>{width}}`    "
+            end = f"**{value}**"
+            if roll.thresh is not None and value >= roll.thresh:
+                end = f"{end} ✓"
+            detail = dice.render_result(
+                res, REPEAT_LINE_LEN - len(start) - len(end) - 9
+            )
+            if detail is None or not dice.is_random(inner):
+                lines.append(start + end)
+            else:
+                lines.append(f"{start}{detail}    ↠    {end}")
+
+    lines.append(summarize_repeat(roll, result.value))
+    return lines
+
+
+def summarize_repeat(roll, values):
+    "min, max and mean of values, and how many reach roll.thresh (if it has one)."
+    if isinstance(values, np.ndarray):
+        lo, hi, mean = values.min(), values.max(), values.mean()
+        hits = None if roll.thresh is None else np.count_nonzero(values >= roll.thresh)
+    else:
+        lo, hi = min(values), max(values)
+        try:
+            mean = sum(values) / len(values)
+        except OverflowError:
+            mean = sum(values) // len(values)
+        hits = None if roll.thresh is None else sum(v >= roll.thresh for v in values)
+
+    parts = [
+        f"min **{format_value(lo)}**",
+        f"max **{format_value(hi)}**",
+        f"mean **{format_value(mean)}**",
+    ]
+    if hits is not None:
+        parts.append(f"**{hits:,}** of {roll.times:,} reach {roll.thresh}")
+    return ",  ".join(parts)
+
+
+def parse_error_message(spec, e):
+    formatted = e.get_context(spec, span=100)
+    return f"""Sorry, I don't understand! I think the error might be here:
+
+```
+{formatted}
+
+{e}
+```"""
+
+
+def too_much_message(problems):
+    return f"Sorry, that's too much for me: {'; '.join(problems)}."
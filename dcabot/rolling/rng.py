@@ -0,0 +1,198 @@
+"""
+Where the dice get their randomness from.
+
+A DiceRNG hands out integers in a range from a buffer, which it fills in bulk, one
+buffer per range (so mostly one per kind of die). The random bits come from one of
+a few backends: the stdlib's random, a numpy Generator, or secrets. All but secrets
+can be seeded, to get the same stream of rolls again.
+
+Each DiceRNG also has a numpy Generator in .numpy, for the things that are done with
+numpy (like big pools), seeded from its own stream. A DiceRNG isn't thread-safe: to
+roll in another thread, give it its own with using(get_rng().spawn()).
+"""
+import contextlib
+import random
+import secrets
+import threading
+
+import numpy as np
+
+# how many numbers to draw at once for each range
+BUFFER_SIZE = 4096
+# throw away all the buffers if there get to be more than this many ranges
+MAX_BUFFERS = 64
+# ranges bigger than this aren't buffered
+MAX_BUFFERED_RANGE = 2**32
+
+
+class DiceRNG:
+    "Base class: subclasses provide random_bytes(n), or override fill()."
+
+    name = None
+
+    def __init__(self, seed=None):
+        self.seed = seed
+        self.buffers = {}
+        self.numpy = self.numpy_generator()
+
+    def __repr__(self):
+        seed = "" if self.seed is None else f", seed={self.seed!r}"
+        return f"<{type(self).__name__} {self.name}{seed}>"
+
+    def random_bytes(self, n):
+        raise NotImplementedError
+
+    def numpy_generator(self):
+        return np.random.default_rng(
+            np.frombuffer(self.random_bytes(32), dtype=np.uint64)
+        )
+
+    def fill(self, a, b, size):
+        "At least size (roughly; maybe a few less) random integers from a to b."
+        n = b - a + 1
+        words = np.frombuffer(self.random_bytes(8 * size), dtype=np.uint64)
+        # throw away the top partial copy of range(n), so that there's no bias
+        extra = 2**64 % n
+        if extra:
+            words = words[words < np.uint64(2**64 - extra)]
+        return ((words % np.uint64(n)).astype(np.int64) + a).tolist()
+
+    def spawn(self):
+        "A new, independent DiceRNG of the same kind; seeded from this one, if it is."
+        if self.seed is None:
+            return type(self)()
+        return type(self)(int.from_bytes(self.random_bytes(16)))
+
+    def randbelow_big(self, n):
+        "A random integer in range(n), for n too big to buffer."
+        n_bytes = (n.bit_length() + 7) // 8 + 8
+        limit = 2 ** (8 * n_bytes) // n * n
+        while (x := int.from_bytes(self.random_bytes(n_bytes))) >= limit:
+            pass
+        return x % n
+
+    def get_buffer(self, a, b):
+        buffer = self.buffers.get((a, b))
+        if buffer is None:
+            if len(self.buffers) >= MAX_BUFFERS:
+                self.buffers.clear()
+            buffer = self.buffers[a, b] = []
+        return buffer
+
+    def randint(self, a, b):
+        "A random integer from a to b, inclusive, like random.randint."
+        if b - a >= MAX_BUFFERED_RANGE:
+            return a + self.randbelow_big(b - a + 1)
+        buffer = self.get_buffer(a, b)
+        if not buffer:
+            buffer.extend(self.fill(a, b, BUFFER_SIZE))
+        return buffer.pop()
+
+    def randints(self, a, b, k):
+        "A list of k random integers from a to b, inclusive."
+        if b - a >= MAX_BUFFERED_RANGE:
+            return [a + self.randbelow_big(b - a + 1) for _ in range(k)]
+        buffer = self.get_buffer(a, b)
+        while len(buffer) < k:
+            buffer.extend(self.fill(a, b, max(k - len(buffer), BUFFER_SIZE)))
+        out = buffer[-k:]
+        del buffer[-k:]
+        return out
+
+
+class RandomRNG(DiceRNG):
+    "The stdlib's Mersenne Twister."
+
+    name = "random"
+
+    def __init__(self, seed=None):
+        self.random = random.Random(seed)
+        super().__init__(seed)
+
+    def random_bytes(self, n):
+        return self.random.randbytes(n)
+
+
+class NumpyRNG(DiceRNG):
+    "A numpy Generator (PCG64), which can draw the bounded integers directly."
+
+    name = "numpy"
+
+    def __init__(self, seed=None):
+        self.generator = np.random.default_rng(seed)
+        super().__init__(seed)
+
+    def random_bytes(self, n):
+        return self.generator.bytes(n)
+
+    def numpy_generator(self):
+        return self.generator
+
+    def fill(self, a, b, size):
+        return self.generator.integers(a, b, size=size, endpoint=True).tolist()
+
+
+class SecretsRNG(DiceRNG):
+    "The OS's cryptographically secure source, via secrets; can't be seeded."
+
+    name = "secrets"
+
+    def __init__(self, seed=None):
+        if seed is not None:
+            raise ValueError("Can't seed the secrets backend")
+        super().__init__()
+
+    def random_bytes(self, n):
+        return secrets.token_bytes(n)
+
+
+BACKENDS = {cls.name: cls for cls in [RandomRNG, NumpyRNG, SecretsRNG]}
+DEFAULT_BACKEND = "numpy"
+
+
+def make_rng(backend=DEFAULT_BACKEND, seed=None):
+    try:
+        cls = BACKENDS[backend]
+    except KeyError:
+        raise ValueError(
+            f"Unknown RNG backend {backend!r}; try one of {', '.join(BACKENDS)}"
+        ) from None
+    return cls(seed)
+
+
+_default = None
+_local = threading.local()
+
+
+def get_rng():
+    "The DiceRNG that dice are currently rolled with, in this thread."
+    rng = getattr(_local, "rng", None)
+    if rng is not None:
+        return rng
+
+    global _default
+    if _default is None:
+        _default = make_rng()
+    return _default
+
+
+def set_rng(rng):
+    "Set the DiceRNG for all threads (except inside using())."
+    global _default
+    _default = rng
+
+
+@contextlib.contextmanager
+def using(rng):
+    "Roll dice with rng in this thread, within the with block."
+    old = getattr(_local, "rng", None)
+    _local.rng = rng
+    try:
+        yield rng
+    finally:
+        _local.rng = old
+
+
+def seeded(seed, backend=DEFAULT_BACKEND):
+    "Roll dice from a fresh stream with this seed, within the with block."
+    return using(make_rng(backend, seed))
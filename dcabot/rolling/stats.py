@@ -0,0 +1,176 @@
+"""
+Statistics of dice expressions, by rolling them lots of times at once with numpy.
+"""
+import numpy as np
+
+from . import cost, dice, optimize
+from .rng import get_rng
+
+DEFAULT_SAMPLES = 100_000
+MAX_SAMPLES = 1_000_000
+
+# roughly how much memory one batch of samples is allowed to use
+MAX_BATCH_BYTES = 64 * 2**20
+# and how many dice, in total, we're willing to roll for one request
+MAX_TOTAL_DICE = 200_000_000
+
+PERCENTILES = [5, 25, 50, 75, 95]
+# histograms of whole numbers go in bins of whole numbers, if they're no bigger than
+# this, so the sums fit in int64
+MAX_INT_BINS = 2**62
+
+
+class TooBigError(ValueError):
+    pass
+
+
+def count_dice(obj):
+    """
+    Roughly how many dice one roll of obj takes, explosions and all (sampling pads
+    each round of explosions out to the most in any sample, so this is on the high
+    side of the average).
+    """
+    if isinstance(obj, dice.DiceRoll):
+        return cost.dice_bound(obj)
+    elif isinstance(obj, (dice.NumHits, dice.CommentedExpr)):
+        return count_dice(obj.roll)
+    elif isinstance(obj, (dice.MathOp, dice.Concat)):
+        return sum(count_dice(arg) for arg in obj.args)
+    else:
+        return 0
+
+
+def sample_width(obj):
+    """
+    Roughly how many numbers sampling one roll of obj holds at once: one per die, as
+    in count_dice, except that big plain pools are sampled as counts of each face.
+    """
+    if type(obj) is dice.DiceRoll and obj.use_counts:
+        return obj.sides
+    elif isinstance(obj, dice.DiceRoll):
+        return cost.dice_bound(obj)
+    elif isinstance(obj, (dice.NumHits, dice.CommentedExpr)):
+        return sample_width(obj.roll)
+    elif isinstance(obj, (dice.MathOp, dice.Concat)):
+        return sum(sample_width(arg) for arg in obj.args)
+    else:
+        return 0
+
+
+def sample(roll, n, rng=None):
+    """
+    Roll roll n times, returning an array of the values. Goes in batches, for memory.
+    The default rng is the numpy Generator of the thread's DiceRNG.
+    """
+    if rng is None:
+        rng = get_rng().numpy
+    roll = optimize.optimize(roll)
+
+    n_dice = count_dice(roll)
+    if n * n_dice > MAX_TOTAL_DICE:
+        raise TooBigError(
+            f"That'd be {n * n_dice:,.0f} dice; the limit is {MAX_TOTAL_DICE:,}. "
+            "Try fewer samples?"
+        )
+
+    # the values themselves, plus a copy for sorting and a mask, per die
+    bytes_per_sample = 24 * max(sample_width(roll), 1) + 64
+    if bytes_per_sample > MAX_BATCH_BYTES:
+        raise TooBigError(
+            f"Even one roll of that would take about {bytes_per_sample / 2**20:,.0f} "
+            f"MB to sample; the limit is {MAX_BATCH_BYTES / 2**20:,.0f} MB."
+        )
+    batch_size = max(int(MAX_BATCH_BYTES // bytes_per_sample), 1)
+
+    out = np.empty(n, dtype=float)
+    for start in range(0, n, batch_size):
+        stop = min(start + batch_size, n)
+        out[start:stop] = dice.sample_tree(roll, stop - start, rng)
+    return out
+
+
+def format_number(x):
+    return f"{x:,.0f}" if float(x).is_integer() else f"{x:,.4g}"
+
+
+def summarize(samples):
+    values, counts = np.unique(samples, return_counts=True)
+    return summarize_distribution(values, counts / len(samples))
+
+
+def summarize_distribution(values, probs):
+    "Describe a distribution: values, sorted and distinct, with their probabilities."
+    values = np.asarray(values)
+    probs = np.asarray(probs)
+    lines = []
+
+    finite = np.isfinite(values)
+    if not finite.all():
+        lines.append(
+            f"({probs[~finite].sum():.2%} of rolls come out infinite or undefined, "
+            "and are left out below)"
+        )
+        values = values[finite]
+        probs = probs[finite]
+    if len(values) == 0:
+        return "\n".join(lines)
+    probs = probs / probs.sum()
+
+    mean = (values * probs).sum()
+    std = np.sqrt((probs * (values - mean) ** 2).sum())
+    lines.append(
+        f"mean {format_number(mean)}, "
+        f"standard deviation {format_number(std)}, "
+        f"range {format_number(values[0])} to {format_number(values[-1])}"
+    )
+
+    cdf = np.cumsum(probs)
+    inds = np.searchsorted(cdf, np.array(PERCENTILES) / 100 - 1e-12)
+    lines.append(
+        "percentiles: "
+        + ",  ".join(
+            f"{p}%: {format_number(v)}" for p, v in zip(PERCENTILES, values[inds])
+        )
+    )
+    lines.append(f"```\n{histogram(values, probs)}\n```")
+    return "\n".join(lines)
+
+
+def histogram(values, probs, width=30, max_bins=20):
+    if all(float(v).is_integer() for v in values) and (
+        -MAX_INT_BINS <= values[0] and values[-1] <= MAX_INT_BINS
+    ):
+        # bins of a whole number of values each
+        lo, hi = int(values[0]), int(values[-1])
+        bin_size = -(-(hi - lo + 1) // max_bins)
+        labels = []
+        for a in range(lo, hi + 1, bin_size):
+            b = min(a + bin_size - 1, hi)
+            label = format_number(a)
+            labels.append(label if a == b else f"{label} to {format_number(b)}")
+        inds = (np.asarray(values, dtype=np.int64) - lo) // bin_size
+        probs = np.bincount(inds, weights=probs, minlength=len(labels))
+    else:
+        try:
+            probs, edges = np.histogram(values, bins=max_bins, weights=probs)
+        except ValueError:
+            # too narrow a range, for numbers this big, to split into bins: so there
+            # can only be a few values, each of which gets its own
+            labels = [format_number(v) for v in values]
+        else:
+            labels = [
+                f"{format_number(lo)} to {format_number(hi)}"
+                for lo, hi in zip(edges[:-1], edges[1:])
+            ]
+
+    return format_bars(labels, probs, width=width)
+
+
+def format_bars(labels, probs, width=30):
+    "A text bar chart, one line per label."
+    label_width = max(len(label) for label in labels)
+    biggest = max(probs)
+    return "\n".join(
+        f"{label:>{label_width}} {p:6.2%} {'█' * round(width * p / biggest)}"
+        for label, p in zip(labels, probs)
+    )
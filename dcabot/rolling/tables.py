@@ -0,0 +1,264 @@
+"""
+Tables of exact distributions, for saying where a roll came out: "(top 8%)".
+
+Working out a distribution takes too long to do for every ~roll, so looking one up
+(lookup()) never works anything out. Instead:
+
+- the common ones (NdM, keep highest/lowest, and E/N/H hit pools) are worked out
+  ahead of time into a file, by build() (or `python -m dcabot.rolling.tables`), which
+  load() memory-maps, so worker processes share the same pages
+- any others are worked out in a background thread the first time they're looked
+  up, and kept in an LRU cache from then on
+
+Tables are keyed by the canonical string of the expression, str(tree). The file
+records which version of the dice code it was built with (see fingerprint()), and
+load_or_build() builds it again if that's changed.
+"""
+import functools
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+import queue
+import sys
+import threading
+
+import lark
+import numpy as np
+
+from . import dice, exact, optimize
+from ..utils import LRUCache
+
+# how many of the others to keep around
+MAX_CACHED = 128
+# how many to have waiting to be worked out at once; any more aren't, for now
+MAX_PENDING = 64
+
+# what goes in the file
+SIDES = [2, 3, 4, 6, 8, 10, 12, 20, 100]
+MAX_DICE = {20: 20, 100: 10}  # NdM up to this many dice, by sides...
+DEFAULT_MAX_DICE = 40  # ...or this many otherwise
+KEEP_SIDES = [4, 6, 8, 10, 12, 20]
+MAX_KEEP_DICE = 6
+MAX_POOL = 30  # E/N/H pools, and d10 >= N, up to this many dice
+# d20 rolls (and with advantage or disadvantage) plus up to this much
+MAX_D20_BONUS = 15
+
+# bump this if the file's layout changes (changes to the dice code are noticed anyway)
+FORMAT_VERSION = 1
+
+
+class StaleTablesError(ValueError):
+    "The file was built by a different version of the dice code."
+
+
+class Table:
+    """
+    The distribution of an expression, for percentile lookups: sorted distinct
+    values, and cumulative[i], the chance of rolling less than values[i] (with one
+    more on the end, which is 1).
+    """
+
+    def __init__(self, values, cumulative):
+        self.values = values
+        self.cumulative = cumulative
+
+    @classmethod
+    def from_distribution(cls, dist):
+        finite = np.isfinite(dist.values)
+        values = dist.values[finite].astype(float)
+        cumulative = np.concatenate([[0.0], np.cumsum(dist.probs[finite])])
+        return cls(values, cumulative)
+
+    def chances(self, x):
+        "(the chance of rolling x or more, and of x or less); x can be an array."
+        below = self.cumulative[self.values.searchsorted(x, side="left")]
+        at_most = self.cumulative[self.values.searchsorted(x, side="right")]
+        return 1 - below, at_most
+
+
+# from the file: canonical spec -> (start, stop) columns of _data
+_index = {}
+_data = None
+# and Tables for the ones from the file that have been looked up
+_file_tables = {}
+# and the others
+_cache = LRUCache(MAX_CACHED)
+_cache_lock = threading.Lock()
+_pending = queue.Queue(MAX_PENDING)
+_pending_specs = set()
+_worker = None
+
+
+def lookup(spec):
+    """
+    The Table for spec, a canonical string, if it's to hand; None if not (or if it
+    can't be worked out). Doesn't work anything out, but if it's never been tried,
+    arranges for that to happen in the background.
+    """
+    if (table := _file_tables.get(spec)) is not None:
+        return table
+    if (cols := _index.get(spec)) is not None:
+        start, stop = cols
+        table = _file_tables[spec] = Table(
+            _data[0, start : stop - 1], _data[1, start:stop]
+        )
+        return table
+    with _cache_lock:
+        if spec in _cache:
+            return _cache[spec]
+        if spec not in _pending_specs:
+            try:
+                _pending.put_nowait(spec)
+            except queue.Full:
+                pass
+            else:
+                _pending_specs.add(spec)
+                start_worker()
+    return None
+
+
+def get_table(spec):
+    "The Table for spec, working it out now if need be; None if it can't be."
+    if spec in _index:
+        return lookup(spec)
+    with _cache_lock:
+        if spec in _cache:
+            return _cache[spec]
+    table = work_out(spec)
+    with _cache_lock:
+        _cache[spec] = table
+    return table
+
+
+def work_out(spec):
+    try:
+        # not get_dice_tree(): its cache isn't safe to use from other threads
+        dist = exact.distribution(dice.parse_dice_tree(spec))
+    except (lark.UnexpectedInput, exact.TooExpensiveError):
+        return None
+    return Table.from_distribution(dist)
+
+
+def start_worker():
+    global _worker
+    if _worker is None:
+        _worker = threading.Thread(
+            target=work_out_pending, name="dice-tables", daemon=True
+        )
+        _worker.start()
+
+
+def work_out_pending():
+    while True:
+        spec = _pending.get()
+        try:
+            table = work_out(spec)
+        except Exception:
+            logging.exception(f"Couldn't work out the distribution of {spec}")
+            table = None
+        with _cache_lock:
+            _cache[spec] = table
+            _pending_specs.discard(spec)
+
+
+def common_specs():
+    "The specs that go in the file."
+    for sides in SIDES:
+        for num in range(1, MAX_DICE.get(sides, DEFAULT_MAX_DICE) + 1):
+            yield f"{num}d{sides}"
+    for sides in KEEP_SIDES:
+        for num in range(2, MAX_KEEP_DICE + 1):
+            for keep in range(1, num):
+                yield f"{num}d{sides}h{keep}"
+                yield f"{num}d{sides}l{keep}"
+    for d20 in ["d20", "2d20h1", "2d20l1"]:
+        for bonus in range(1, MAX_D20_BONUS + 1):
+            yield f"{d20}+{bonus}"
+            yield f"{d20}-{bonus}"
+    for num in range(1, MAX_POOL + 1):
+        for pool in "ENH":
+            yield f"{pool}{num}"
+        for target in range(2, 11):
+            yield f"{num}d10>={target}"
+
+
+@functools.cache
+def fingerprint():
+    """
+    A hash of everything the tables depend on: the file layout, the grammar, and the
+    code that decides the canonical strings and works out the distributions.
+    """
+    h = hashlib.sha256(f"{FORMAT_VERSION}\n{dice.grammar}".encode())
+    for module in [dice, exact, optimize]:
+        h.update(Path(module.__file__).read_bytes())
+    return h.hexdigest()
+
+
+def paths(path):
+    "The data and index files for the tables at path (without a suffix)."
+    path = Path(path)
+    return path.with_suffix(".npy"), path.with_suffix(".json")
+
+
+def build(path, specs=None):
+    "Work out the tables for specs (default: common_specs()), and write them to path."
+    index = {}
+    columns = []
+    n = 0
+    for spec in common_specs() if specs is None else specs:
+        key = str(dice.parse_dice_tree(spec))
+        if key in index or (table := work_out(spec)) is None:
+            continue
+        values = np.append(table.values, np.inf)  # to line up with cumulative
+        columns.append(np.stack([values, table.cumulative]))
+        index[key] = (n, n + len(values))
+        n += len(values)
+
+    data_path, index_path = paths(path)
+    # write to temporary files first, so nothing can load half of it
+    with open(f"{data_path}.tmp", "wb") as f:
+        np.save(f, np.concatenate(columns, axis=1))
+    with open(f"{index_path}.tmp", "w") as f:
+        json.dump({"version": fingerprint(), "tables": index}, f)
+    os.replace(f"{data_path}.tmp", data_path)
+    os.replace(f"{index_path}.tmp", index_path)
+    return len(index)
+
+
+def load(path):
+    """
+    Memory-map the tables at path, as written by build(); returns how many there are.
+    Raises StaleTablesError if they're from a different version of the dice code.
+    """
+    global _index, _data, _file_tables
+    data_path, index_path = paths(path)
+    with open(index_path) as f:
+        saved = json.load(f)
+    # (files from before there were versions are just the index)
+    if saved.get("version") != fingerprint():
+        raise StaleTablesError(f"{index_path} is from another version; rebuild it")
+    index = {spec: tuple(cols) for spec, cols in saved["tables"].items()}
+    # a plain array over the mapped memory: slicing np.memmaps is slow
+    _data = np.asarray(np.load(data_path, mmap_mode="r"))
+    _file_tables = {}
+    _index = index
+    return len(_index)
+
+
+def load_or_build(path):
+    "load(path), building the file first if it isn't there yet, or is out of date."
+    if all(p.exists() for p in paths(path)):
+        try:
+            return load(path)
+        except StaleTablesError:
+            logging.info(f"Dice distribution tables in {path}.npy are out of date")
+    logging.info(f"Building dice distribution tables in {path}.npy")
+    build(path)
+    return load(path)
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else "dice_tables"
+    print(f"Wrote {build(path)} tables to {paths(path)[0]}")
@@ -0,0 +1,139 @@
+"""
+Rolling dice in a pool of worker processes, so that one roll that takes ages doesn't
+hold up everything else the bot is doing (heartbeats included), and can be stopped.
+
+Each worker imports the grammar once, when it starts. A job sends a spec and the RNG
+stream to roll it with; what comes back is just the text to reply with, and what to
+record in the roll history: (lines, file_lines, entries), where file_lines is None
+unless the lines need sending as a file.
+"""
+import asyncio
+import concurrent.futures
+import multiprocessing
+import re
+
+import lark
+
+from . import cost, dice, render, rng, tables
+
+# how long a roll can take before we give up on it, in seconds
+DEFAULT_TIMEOUT = 10.0
+
+# specs this short, with no numbers of four or more digits, are rolled inline
+CHEAP_SPEC_LEN = 100
+BIG_NUMBER = re.compile(r"\d{4,}")
+
+
+def looks_cheap(spec):
+    "A quick guess, without parsing it, at whether spec is cheap enough to roll inline."
+    return len(spec) <= CHEAP_SPEC_LEN and BIG_NUMBER.search(spec) is None
+
+
+_limits = None
+
+
+def init_worker(limits, tables_path=None):
+    global _limits
+    _limits = limits
+    if tables_path is not None:
+        # the file's already built by now; mapping it shares the pages with the bot
+        tables.load(tables_path)
+    # importing dice built the parser; build the fallback one too, while we're at it
+    dice.get_lenient_parser()
+
+
+def warm_up():
+    pass
+
+
+def roll_job(spec, stream):
+    "Parse and roll spec with the DiceRNG stream, in a worker."
+    try:
+        roll = dice.get_dice_tree(spec)
+    except lark.UnexpectedInput as e:
+        return [render.parse_error_message(spec, e)], None, []
+
+    if problems := _limits.problems(cost.estimate(roll)):
+        return [render.too_much_message(problems)], None, []
+
+    with rng.using(stream):
+        lines, file_lines, entries = render.roll_and_format(roll)
+    return lines, file_lines() if render.needs_file(lines) else None, entries
+
+
+class DicePool:
+    """
+    A warm pool of processes to roll dice in. A roll that's still going after timeout
+    seconds is stopped by killing the processes and starting new ones; any other rolls
+    that were caught up in that get started again in the new pool.
+    """
+
+    def __init__(self, workers, timeout=DEFAULT_TIMEOUT, limits=None, tables_path=None):
+        self.workers = workers
+        self.timeout = timeout
+        self.limits = cost.Limits() if limits is None else limits
+        self.tables_path = tables_path
+        self.executor = None
+        self.warming_up = []
+        # only hand the pool as many jobs as it has workers, so the timeout only counts
+        # time spent rolling, not queueing behind someone else's roll
+        self.running = asyncio.Semaphore(workers)
+
+    def start(self):
+        self.executor = concurrent.futures.ProcessPoolExecutor(
+            self.workers,
+            # forking a process that's running an event loop and threads isn't safe
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker,
+            initargs=(self.limits, self.tables_path),
+        )
+        # start all the processes now, rather than when the first big roll comes in
+        self.warming_up = [self.executor.submit(warm_up) for _ in range(self.workers)]
+
+    async def wait_until_warm(self):
+        if waiting := [asyncio.wrap_future(f) for f in self.warming_up if not f.done()]:
+            await asyncio.wait(waiting)
+
+    def stop(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    def kill(self, executor):
+        "Stop executor's processes, even mid-job; restart the pool if it was ours."
+        processes = list((executor._processes or {}).values())
+        # not cancel_futures: the other jobs should fail with BrokenExecutor, so that
+        # they get another go, rather than being cancelled
+        executor.shutdown(wait=False)
+        for process in processes:
+            process.terminate()
+        if executor is self.executor:
+            self.start()
+
+    async def roll(self, spec, stream):
+        """
+        Parse and roll spec in a worker, with the DiceRNG stream; returns (lines,
+        file_lines, entries). Raises TimeoutError if it takes too long.
+        """
+        async with self.running:
+            for attempt in range(2):
+                # starting the processes doesn't count towards the timeout either
+                await self.wait_until_warm()
+                executor = self.executor
+                future = None
+                try:
+                    future = executor.submit(roll_job, spec, stream)
+                    return await asyncio.wait_for(
+                        asyncio.wrap_future(future), self.timeout
+                    )
+                except (TimeoutError, asyncio.CancelledError):
+                    if future is not None and not (future.cancel() or future.done()):
+                        # it's already running; the only way to stop it is its process
+                        self.kill(executor)
+                    raise
+                except concurrent.futures.BrokenExecutor:
+                    # another roll was killed, or a worker died; try again in a new pool
+                    if executor is self.executor:
+                        self.kill(executor)
+                    if attempt:
+                        raise
@@ -1,5 +1,15 @@
-from collections import OrderedDict
+import asyncio
+import base64
+import binascii
+import functools
+import json
 import logging
+import random
+import sqlite3
+import threading
+import time
+import weakref
+import zlib
 
 import discord
 from discord import app_commands
@@ -24,17 +34,359 @@ EMOJI_UNCHECKED = ":black_large_square:"
 SPOTLIGHT_HEADER = "__Spotlight checklist__"
 SHUTDOWN_MESSAGE = "Clearing the spotlight tracker; goodnight!"
 
+# the tracker's state also goes in the embed's footer, encoded, so it can be read
+# back exactly; this says which encoding, in case it changes
+FOOTER_PREFIX = "sp1:"
+MAX_FOOTER_LEN = 2048  # Discord's limit
+
+
+# how many times to try a command if other processes keep changing the tracker while
+# it's going, waiting a random while (up to twice as long each time) in between
+MAX_ATTEMPTS = 10
+RETRY_DELAY = 0.01
+
+# in edit-in-place mode, how long to wait after a change before editing the tracker
+# message, so that a burst of changes makes one edit
+EDIT_DELAY = 1.0
+
+# at startup, load the trackers of channels that used them in the last
+# WARM_UP_DAYS (up to WARM_UP_MAX of them, or as many as the cache holds),
+# WARM_UP_CONCURRENCY at a time, since loading one from history takes a couple of
+# requests to Discord
+WARM_UP_DAYS = 7
+WARM_UP_MAX = 100
+WARM_UP_CONCURRENCY = 4
+# how often (at most) to note that a channel's been active, in seconds
+ACTIVE_RESOLUTION = 600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS spotlights (
+    channel INTEGER PRIMARY KEY,
+    state TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    message INTEGER
+)
+"""
+ACTIVITY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS activity (
+    channel INTEGER PRIMARY KEY,
+    last_active REAL NOT NULL
+)
+"""
+# columns added since the first version, for files from before them
+NEW_COLUMNS = {
+    "version": "version INTEGER NOT NULL DEFAULT 1",
+    "message": "message INTEGER",
+}
+
 
 class NoSpotlightError(ValueError):
     pass
 
 
+class SpotlightConflict(Exception):
+    "The tracker was changed by someone else since we read it."
+
+
+class SpotlightStore:
+    """
+    The state of each channel's tracker, kept in the SQLite file at path: as a JSON
+    list of [participant, checked] pairs, with an empty list once it's closed; and
+    the id of the message showing it, in edit-in-place mode. Also when each channel
+    last used a tracker, to know which to load at startup.
+
+    Each has a version, which goes up by one with every change, and changes only go
+    through if the version is still the one the change was based on; so several
+    processes can share the file without losing each other's changes. Everything is
+    done in a thread, so none of it holds up the event loop.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        # so readers in other processes don't wait for writers
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(SCHEMA)
+        self.db.execute(ACTIVITY_SCHEMA)
+        columns = [row[1] for row in self.db.execute("PRAGMA table_info(spotlights)")]
+        for name, column in NEW_COLUMNS.items():
+            if name not in columns:
+                self.db.execute(f"ALTER TABLE spotlights ADD COLUMN {column}")
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    async def load(self, channel_id):
+        "(state, version) saved for channel_id, or (None, 0) if there isn't one."
+        row = await asyncio.to_thread(self.read, channel_id)
+        if row is None:
+            return None, 0
+        text, version = row
+        return dict(json.loads(text)), version
+
+    async def compare_and_swap(self, channel_id, version, state):
+        """
+        Save state for channel_id, if what's there is still at version (0 if nothing
+        is); returns whether it was saved, as version + 1.
+        """
+        text = json.dumps(list(state.items()))
+        return await asyncio.to_thread(self.swap, channel_id, version, text)
+
+    async def version(self, channel_id):
+        "The version saved for channel_id (0 if there isn't one), without the state."
+        row = await asyncio.to_thread(self.read, channel_id, "version")
+        return 0 if row is None else row[0]
+
+    async def load_message(self, channel_id):
+        "The id of the message showing channel_id's tracker, or None."
+        row = await asyncio.to_thread(self.read, channel_id, "message")
+        return None if row is None else row[0]
+
+    async def save_message(self, channel_id, message_id):
+        "Save the id of the message showing channel_id's tracker (if it has one)."
+
+        def write():
+            with self.lock:
+                with self.db:
+                    self.db.execute(
+                        "UPDATE spotlights SET message = ? WHERE channel = ?",
+                        (message_id, channel_id),
+                    )
+
+        await asyncio.to_thread(write)
+
+    async def note_active(self, channel_id, when):
+        def write():
+            with self.lock:
+                with self.db:
+                    self.db.execute(
+                        "INSERT OR REPLACE INTO activity (channel, last_active) "
+                        "VALUES (?, ?)",
+                        (channel_id, when),
+                    )
+
+        await asyncio.to_thread(write)
+
+    async def active_channels(self, since, limit):
+        """
+        The ids of the channels active since then (a time.time()), most recent
+        first, up to limit of them; forgets about the others.
+        """
+
+        def read():
+            with self.lock:
+                with self.db:
+                    self.db.execute(
+                        "DELETE FROM activity WHERE last_active < ?", (since,)
+                    )
+                return self.db.execute(
+                    "SELECT channel FROM activity ORDER BY last_active DESC LIMIT ?",
+                    (limit,),
+                ).fetchall()
+
+        return [channel_id for (channel_id,) in await asyncio.to_thread(read)]
+
+    def read(self, channel_id, columns="state, version"):
+        with self.lock:
+            return self.db.execute(
+                f"SELECT {columns} FROM spotlights WHERE channel = ?", (channel_id,)
+            ).fetchone()
+
+    def swap(self, channel_id, version, text):
+        with self.lock:
+            with self.db:
+                if version == 0:
+                    cursor = self.db.execute(
+                        "INSERT OR IGNORE INTO spotlights (channel, state, version) "
+                        "VALUES (?, ?, 1)",
+                        (channel_id, text),
+                    )
+                else:
+                    cursor = self.db.execute(
+                        "UPDATE spotlights SET state = ?, version = version + 1 "
+                        "WHERE channel = ? AND version = ?",
+                        (text, channel_id, version),
+                    )
+        return cursor.rowcount == 1
+
+
+def one_at_a_time(callback):
+    """
+    Run a command with its channel's tracker locked, so the commands on each tracker
+    in this process go one after another; and if another process changes it while
+    the command is going, start the command over on the new version.
+    """
+
+    @functools.wraps(callback)
+    async def wrapper(self, ctx, *args, **kwargs):
+        if getattr(ctx, "spotlight_locked", False):
+            # called from another command that already has the lock
+            return await callback(self, ctx, *args, **kwargs)
+
+        await self.note_active(ctx.channel)
+        async with self.lock_for(ctx.channel):
+            ctx.spotlight_locked = True
+            try:
+                for attempt in range(MAX_ATTEMPTS):
+                    if attempt:
+                        await asyncio.sleep(random.uniform(0, RETRY_DELAY * 2**attempt))
+                    # another process might've changed it since it was cached
+                    await self.forget_if_changed(ctx.channel)
+                    try:
+                        return await callback(self, ctx, *args, **kwargs)
+                    except SpotlightConflict:
+                        pass
+            finally:
+                ctx.spotlight_locked = False
+        await ctx.send("Sorry, the tracker kept changing while I was at it; try again?")
+
+    return wrapper
+
+
+def encode_state(state):
+    """
+    A compact string for state: the names in order, and which are checked as bits
+    of a hex number, compressed and base64ed, after FOOTER_PREFIX.
+    """
+    checked = sum(1 << i for i, st in enumerate(state.values()) if st)
+    data = json.dumps([list(state), f"{checked:x}"], separators=(",", ":"))
+    packed = base64.urlsafe_b64encode(zlib.compress(data.encode(), 9))
+    return FOOTER_PREFIX + packed.decode("ascii")
+
+
+def decode_state(text):
+    "The state encoded by encode_state() in text, or None if it isn't one."
+    if not text or not text.startswith(FOOTER_PREFIX):
+        return None
+    try:
+        packed = text.removeprefix(FOOTER_PREFIX).encode("ascii")
+        names, checked = json.loads(zlib.decompress(base64.urlsafe_b64decode(packed)))
+        checked = int(checked, 16)
+    except (ValueError, TypeError, binascii.Error, zlib.error):
+        return None
+    if not all(isinstance(name, str) for name in names):
+        return None
+    return {name: bool(checked >> i & 1) for i, name in enumerate(names)}
+
+
+def tracker_embed(state):
+    embed = discord.Embed(
+        title=SPOTLIGHT_HEADER,
+        color=TRACKER_COLOR,
+        description="\n".join(
+            f"{EMOJI_CHECKED if st else EMOJI_UNCHECKED} {p}" for p, st in state.items()
+        ),
+    )
+    # if it doesn't fit, recovering falls back to reading the description
+    if len(footer := encode_state(state)) <= MAX_FOOTER_LEN:
+        embed.set_footer(text=footer)
+    return embed
+
+
 class Spotlight(commands.Cog):
-    # this will remember stuff per channel, and recover it if the bot died
-    # it's not safe for multiple simultaneous workers (for the same channel) as-is
-    def __init__(self, bot, cache_size=128):
+    # this will remember stuff per channel, and recover it if the bot died; commands
+    # on the same channel are safe to run at the same time, in this process or (with
+    # a store) in others
+    def __init__(self, bot, cache_size=128, store=None, edit_in_place=False):
         self.bot = bot
+        # channel -> (state, version), as last read or written
         self._cache = LRUCache(cache_size)
+        # a SpotlightStore to keep trackers in, if any
+        self.store = store
+        # channel id -> asyncio.Lock, for as long as anything's using it
+        self._locks = weakref.WeakValueDictionary()
+
+        # whether to keep one tracker message per channel and edit it, rather than
+        # sending a new one for every change
+        self.edit_in_place = edit_in_place
+        # channel id -> id of the message showing its tracker (or None)
+        self._messages = LRUCache(cache_size)
+        # channel id -> channel, for the ones whose message needs editing
+        self._outdated = {}
+        # channel id -> task that edits its message, after EDIT_DELAY
+        self._editing = {}
+
+        # channel id -> task loading its tracker, while it's going
+        self._loading = {}
+        # channel id -> when this process last noted it was active
+        self._noted_active = LRUCache(cache_size)
+        self._warmed_up = False
+
+    async def cog_unload(self):
+        for task in self._editing.values():
+            task.cancel()
+        # bring the messages up to date now, rather than after the delay
+        for channel in list(self._outdated.values()):
+            try:
+                await self.update_message(channel)
+            except Exception:
+                _log.exception("Couldn't update spotlight tracker in %s", channel)
+        if self.store is not None:
+            self.store.close()
+
+    def lock_for(self, channel):
+        lock = self._locks.get(channel.id)
+        if lock is None:
+            self._locks[channel.id] = lock = asyncio.Lock()
+        return lock
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        # this is a task of its own, so commands don't wait for it; and on_ready
+        # happens again after reconnecting, but once is enough
+        if not self._warmed_up:
+            self._warmed_up = True
+            await self.warm_up()
+
+    async def warm_up(self):
+        "Load the trackers of recently active channels, so their first command's quick."
+        if self.store is None:
+            return
+        since = time.time() - WARM_UP_DAYS * 24 * 60 * 60
+        limit = min(WARM_UP_MAX, self._cache.max_size)
+        channel_ids = await self.store.active_channels(since, limit)
+        start = time.perf_counter()
+        semaphore = asyncio.Semaphore(WARM_UP_CONCURRENCY)
+        async with asyncio.TaskGroup() as tg:
+            for channel_id in channel_ids:
+                tg.create_task(self.warm_up_channel(channel_id, semaphore))
+        _log.info(
+            "Loaded spotlight trackers for %d channels in %.1fs",
+            len(channel_ids),
+            time.perf_counter() - start,
+        )
+
+    async def warm_up_channel(self, channel_id, semaphore):
+        async with semaphore:
+            # only channels discord.py already knows, which doesn't take a request
+            if (channel := self.bot.get_channel(channel_id)) is None:
+                return
+            try:
+                await self.ensure_loaded(channel)
+            except Exception:
+                _log.exception("Couldn't load spotlight tracker for %s", channel)
+
+    async def note_active(self, channel):
+        if self.store is None:
+            return
+        now = time.time()
+        if now - self._noted_active.get(channel.id, 0) >= ACTIVE_RESOLUTION:
+            self._noted_active[channel.id] = now
+            await self.store.note_active(channel.id, now)
+
+    def forget(self, channel):
+        if channel in self._cache:
+            del self._cache[channel]
+
+    async def forget_if_changed(self, channel):
+        "Forget the cached tracker if the store has a newer one; checks the version."
+        if self.store is None or channel not in self._cache:
+            return
+        _, version = self._cache[channel]
+        if await self.store.version(channel.id) != version:
+            self.forget(channel)
 
     async def cog_command_error(self, ctx, exception, /):
         _log.error("Ignoring exception in command %s", ctx.command, exc_info=exception)
@@ -43,23 +395,76 @@ class Spotlight(commands.Cog):
             m = m + f"\n```{exception}```"
         await ctx.reply(m)
 
-    async def get_spotlight(self, channel, message_limit=200):
+    async def get_spotlight(self, channel):
+        """
+        A copy of the channel's tracker, to change and then pass to send_tracker();
+        raises NoSpotlightError if there isn't one.
+        """
+        await self.ensure_loaded(channel)
+        state, _ = self._cache[channel]
+        if state is None:
+            raise NoSpotlightError("No spotlight found in this channel")
+        return dict(state)
+
+    async def ensure_loaded(self, channel):
+        """
+        Make sure the channel's tracker is in the cache; if it's already being
+        loaded (say, warming up), wait for that rather than loading it again.
+        """
         if channel in self._cache:
-            return self._cache[channel]
+            return
+        if (task := self._loading.get(channel.id)) is None:
+            task = asyncio.create_task(self.load_spotlight(channel))
+            self._loading[channel.id] = task
+            task.add_done_callback(lambda _: self._loading.pop(channel.id, None))
+        # if whatever's waiting is cancelled, let the load finish for the others
+        await asyncio.shield(task)
+
+    async def load_spotlight(self, channel):
+        if self.store is not None:
+            state, version = await self.store.load(channel.id)
+            if state is not None:
+                self._cache[channel] = state, version
+                return
+
+        # nothing saved: it's from before there was a store, or there isn't one
+        try:
+            state = await self.find_spotlight(channel)
+        except NoSpotlightError:
+            # (with a store, this stays cached until one's saved there)
+            self._cache[channel] = None, 0
+            return
+        if self.store is not None:
+            if not await self.store.compare_and_swap(channel.id, 0, state):
+                # someone else just saved one; go with theirs
+                state, version = await self.store.load(channel.id)
+                self._cache[channel] = state, version
+                return
+            self._cache[channel] = state, 1
+            if (message_id := self._messages.get(channel.id)) is not None:
+                await self.store.save_message(channel.id, message_id)
+        else:
+            self._cache[channel] = state, 0
 
+    async def find_spotlight(self, channel, message_limit=200):
+        "Look for the last tracker in the channel's recent history."
         async for message in channel.history(limit=message_limit):
             if message.author != self.bot.user:
                 continue
 
             if message.content == SHUTDOWN_MESSAGE:
-                self._cache[channel] = {}
+                return {}
 
             if len(message.embeds) != 1:
                 continue
             (embed,) = message.embeds
             if embed.title != SPOTLIGHT_HEADER:
                 continue
+            self._messages[channel.id] = message.id
 
+            if (state := decode_state(embed.footer.text)) is not None:
+                return state
+            # from before the footer, or too big for one
             state = {}
             for line in embed.description.strip().splitlines():
                 if line.startswith(EMOJI_CHECKED):
@@ -70,24 +475,99 @@ class Spotlight(commands.Cog):
                     state[p] = False
                 else:
                     break  # message at the end, or confusion
-            self._cache[channel] = state
             return state
 
         raise NoSpotlightError("No spotlight found in this channel's recent history")
 
-    async def send_tracker(self, ctx, state, message=None):
-        self._cache[ctx.channel] = state  # be safe
-        await ctx.send(
-            message,
-            embed=discord.Embed(
-                title=SPOTLIGHT_HEADER,
-                color=TRACKER_COLOR,
-                description="\n".join(
-                    f"{EMOJI_CHECKED if st else EMOJI_UNCHECKED} {p}"
-                    for p, st in state.items()
-                ),
-            ),
-        )
+    async def save_spotlight(self, channel, state):
+        """
+        Make state the channel's tracker. Raises SpotlightConflict if it's been
+        changed by another process since it was read, or was never read.
+        """
+        if channel not in self._cache:
+            raise SpotlightConflict()
+        _, version = self._cache[channel]
+        if self.store is not None:
+            if not await self.store.compare_and_swap(channel.id, version, state):
+                raise SpotlightConflict()
+            version += 1
+        self._cache[channel] = dict(state), version
+
+    async def send_tracker(self, ctx, state, message=None, move=False):
+        """
+        Save state as the channel's tracker, and show it. In edit-in-place mode, that
+        edits the tracker message a little later, or (if move) sends a new one.
+        """
+        await self.save_spotlight(ctx.channel, state)
+        if not self.edit_in_place:
+            await ctx.send(message, embed=tracker_embed(state))
+            return
+
+        if move:
+            await self.retire_message(ctx.channel)
+        self.edit_soon(ctx.channel)
+        if message:
+            await ctx.send(message)
+        elif ctx.interaction is not None:
+            await ctx.send("Updated the tracker.", ephemeral=True)
+        else:
+            await ctx.message.add_reaction("\N{WHITE HEAVY CHECK MARK}")
+
+    async def tracker_message(self, channel):
+        "The id of the message showing the channel's tracker, or None."
+        if channel.id not in self._messages and self.store is not None:
+            self._messages[channel.id] = await self.store.load_message(channel.id)
+        return self._messages.get(channel.id)
+
+    async def set_tracker_message(self, channel, message_id):
+        self._messages[channel.id] = message_id
+        if self.store is not None:
+            await self.store.save_message(channel.id, message_id)
+
+    async def retire_message(self, channel):
+        "Leave the channel's tracker message be: the next change sends a new one."
+        if self.edit_in_place:
+            self._outdated.pop(channel.id, None)
+            await self.set_tracker_message(channel, None)
+
+    def edit_soon(self, channel):
+        "Bring the channel's tracker message up to date, after EDIT_DELAY."
+        self._outdated[channel.id] = channel
+        if channel.id not in self._editing:
+            self._editing[channel.id] = asyncio.create_task(self.edit_later(channel))
+
+    async def edit_later(self, channel):
+        try:
+            # anything else that changes meanwhile goes in the same edit
+            while channel.id in self._outdated:
+                await asyncio.sleep(EDIT_DELAY)
+                if channel.id in self._outdated:  # not retired meanwhile
+                    await self.update_message(channel)
+        except Exception:
+            _log.exception("Couldn't update spotlight tracker in %s", channel)
+        finally:
+            del self._editing[channel.id]
+
+    async def update_message(self, channel):
+        "Edit the channel's tracker message to match its tracker, or send a new one."
+        self._outdated.pop(channel.id, None)
+        if self.store is not None:
+            # another process might've changed it since
+            state, _ = await self.store.load(channel.id)
+        else:
+            state, _ = self._cache.get(channel, (None, 0))
+        if state is None:
+            return
+
+        embed = tracker_embed(state)
+        if (message_id := await self.tracker_message(channel)) is not None:
+            try:
+                await channel.get_partial_message(message_id).edit(embed=embed)
+                return
+            except discord.NotFound:
+                pass  # deleted; send another
+        message = await channel.send(embed=embed)
+        await self.set_tracker_message(channel, message.id)
 
     async def find_participant(self, ctx, par):
         state = await self.get_spotlight(ctx.channel)
@@ -107,6 +587,7 @@ class Spotlight(commands.Cog):
         return par
 
     @commands.hybrid_group(invoke_without_command=True, aliases=["sp"])
+    @one_at_a_time
     async def spotlight(self, ctx, *args):
         if not args:
             try:
@@ -114,7 +595,7 @@ class Spotlight(commands.Cog):
             except NoSpotlightError:
                 await self.start(ctx)
             else:
-                await self.send_tracker(ctx, state)
+                await self.send_tracker(ctx, state, move=True)
 
         elif len(args) == 1:
             return await self.mark(ctx, args[0])
@@ -123,15 +604,22 @@ class Spotlight(commands.Cog):
             await ctx.send("Error: not sure how to interpret this command, sorry....")
 
     @spotlight.command(aliases=["shutdown", "off", "stop", "finish"])
+    @one_at_a_time
     async def close(self, ctx):
         "Shut down a spotlight tracker."
-        self._cache[ctx.channel] = {}
+        try:
+            await self.get_spotlight(ctx.channel)
+        except NoSpotlightError:
+            pass
+        await self.save_spotlight(ctx.channel, {})
+        await self.retire_message(ctx.channel)
         await ctx.send(SHUTDOWN_MESSAGE)
 
     # would be reallly nice to use a decorator and *participants,
     # but can't figure out how to get the annotations to work there
 
     @spotlight.command(aliases=["on", "begin"])
+    @one_at_a_time
     async def start(
         self,
         ctx,
@@ -150,11 +638,34 @@ class Spotlight(commands.Cog):
         If any names have spaces, make sure to use quotes.
         """
         # default to the non-bot people present
+        participants = [
+            p
+            for p in [
+                participant1,
+                participant2,
+                participant3,
+                participant4,
+                participant5,
+                participant6,
+                participant7,
+                participant8,
+            ]
+            if p
+        ]
 
-        self._cache[ctx.channel] = {}
-        await self.add(ctx, *participants)
+        try:
+            await self.get_spotlight(ctx.channel)
+        except NoSpotlightError:
+            pass
+        await self.save_spotlight(ctx.channel, {})
+        await self.retire_message(ctx.channel)
+        if participants:
+            await self.add(ctx, *participants)
+        else:
+            await self.send_tracker(ctx, {})
 
     @spotlight.command()
+    @one_at_a_time
     async def add(
         self,
         ctx,
@@ -171,7 +682,7 @@ class Spotlight(commands.Cog):
         try:
             state = await self.get_spotlight(ctx.channel)
         except NoSpotlightError:
-            state = self._cache[ctx.channel] = {}
+            state = {}
 
         participants = [
             p
@@ -216,6 +727,7 @@ class Spotlight(commands.Cog):
 
     @spotlight.command()
     @app_commands.autocomplete(participant1=part_auto, participant2=part_auto, participant3=part_auto, participant4=part_auto, participant5=part_auto, participant6=part_auto, participant7=part_auto, participant8=part_auto)
+    @one_at_a_time
     async def mark(
         self,
         ctx,
@@ -272,6 +784,7 @@ class Spotlight(commands.Cog):
 
     @spotlight.command(aliases=["uncheck", "reset"])
     @app_commands.autocomplete(participant1=part_auto, participant2=part_auto, participant3=part_auto, participant4=part_auto, participant5=part_auto, participant6=part_auto, participant7=part_auto, participant8=part_auto)
+    @one_at_a_time
     async def clear(
         self,
         ctx,
@@ -327,6 +840,7 @@ class Spotlight(commands.Cog):
 
     @spotlight.command()
     @app_commands.autocomplete(participant1=part_auto, participant2=part_auto, participant3=part_auto, participant4=part_auto, participant5=part_auto, participant6=part_auto, participant7=part_auto, participant8=part_auto)
+    @one_at_a_time
     async def remove(
         self,
         ctx,
@@ -368,6 +882,7 @@ class Spotlight(commands.Cog):
 
     @spotlight.command()
     @app_commands.autocomplete(old_name=part_auto)
+    @one_at_a_time
     async def rename(self, ctx, old_name, new_name):
         "Rename someone."
         state = await self.get_spotlight(ctx.channel)
@@ -389,14 +904,18 @@ class Spotlight(commands.Cog):
         return await self.send_tracker(ctx, state)
 
     @spotlight.command()
+    @one_at_a_time
     async def sort(self, ctx):
         "Alphabetize the entries in the checklist."
         state = await self.get_spotlight(ctx.channel)
-        self._cache[ctx.channel] = new = OrderedDict()
+        new = {}
         for k, v in sorted(state.items(), key=lambda kv: kv[0].lower()):
             new[k] = v
         return await self.send_tracker(ctx, new)
 
 
 async def setup(bot):
-    await bot.add_cog(Spotlight(bot))
+    store = SpotlightStore(bot.spotlight_db_path) if bot.spotlight_db_path else None
+    await bot.add_cog(
+        Spotlight(bot, store=store, edit_in_place=bot.spotlight_edit_in_place)
+    )
@@ -6,6 +6,8 @@ class LRUCache:
     def __init__(self, max_size=128):
         self.max_size = max_size
         self._items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
 
     def touch(self, key):
         self._items.move_to_end(key, last=False)
@@ -13,18 +15,30 @@ class LRUCache:
     def __contains__(self, key):
         return key in self._items
 
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, default=None):
+        "Like dict.get, but also counts hits and misses."
+        if key in self._items:
+            self.hits += 1
+            return self[key]
+        else:
+            self.misses += 1
+            return default
+
     def __getitem__(self, key):
         if key in self._items:
             self.touch(key)
         return self._items[key]
 
     def __setitem__(self, key, value):
+        # most recently used at the front, so the one to evict is at the back
         if key not in self._items:
             while len(self._items) >= self.max_size:
                 self._items.popitem(last=True)
-        else:
-            self.touch(key)
         self._items[key] = value
+        self.touch(key)
 
     def __delitem__(self, key):
         del self._items[key]
@@ -12,7 +12,33 @@ def main():
     load_dotenv()
     discord.utils.setup_logging(level=os.environ.get("LOG_LEVEL", "INFO"))
 
-    bot = DCABot()
+    # DICE_RNG picks where dice rolls come from: numpy (default), random or secrets;
+    # setting DICE_RNG_SEED makes them repeatable
+    seed = os.environ.get("DICE_RNG_SEED")
+    # DICE_MAX_WORK etc override the limits in dcabot.rolling.cost.Limits
+    dice_limits = {
+        name.removeprefix("DICE_").lower(): int(value)
+        for name, value in os.environ.items()
+        if name.startswith(("DICE_MAX_", "DICE_INLINE_"))
+    }
+    # DICE_WORKERS > 0 rolls anything big in that many worker processes, giving up
+    # after DICE_TIMEOUT seconds; DICE_MACROS_DB is where ~macro saves things (an
+    # empty value turns macros off); DICE_TABLES is where to keep the distributions
+    # of common rolls, for "(top 8%)" (built if they're not there; if it's empty,
+    # they're worked out as they come up instead)
+    bot = DCABot(
+        dice_rng=os.environ.get("DICE_RNG", "numpy"),
+        dice_rng_seed=None if seed is None else int(seed),
+        dice_limits=dice_limits,
+        dice_workers=int(os.environ.get("DICE_WORKERS", 0)),
+        dice_timeout=float(os.environ.get("DICE_TIMEOUT", 10)),
+        dice_macros_path=os.environ.get("DICE_MACROS_DB", "macros.sqlite3"),
+        dice_tables_path=os.environ.get("DICE_TABLES", "dice_tables"),
+        # where spotlight trackers are kept (empty: only in the channels themselves);
+        # SPOTLIGHT_EDIT_IN_PLACE=1 keeps one tracker message and edits it
+        spotlight_db_path=os.environ.get("SPOTLIGHT_DB", "spotlight.sqlite3"),
+        spotlight_edit_in_place=os.environ.get("SPOTLIGHT_EDIT_IN_PLACE") == "1",
+    )
     bot.run(os.environ["DISCORD_TOKEN"], log_handler=None)
 
 